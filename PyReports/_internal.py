@@ -5,26 +5,77 @@ Created on Wed Jan 19 18:51:06 2022
 @author: Sina Tureli
 """
 
-import PIL as _PIL
 import _io
 import re as _re
-import matplotlib.pyplot as _plt
+import sys as _sys
 import base64 as _b64
-import numpy as _np
-from bs4 import BeautifulSoup as _bs
+import mimetypes as _mimetypes
+import html as _html
+import functools as _functools
+import importlib.util as _importlib_util
 from  numbers import Number
 
+# matplotlib, PIL, numpy, pandas, bs4 and pygments take long to import so they
+# are imported by the functions which use them, the first time they are used
+
+
+def is_figure(obj):
+    '''
+    whether obj is a matplotlib figure. This does not import matplotlib, if it
+    has not been imported obj can not be a figure.
+    '''
+
+    figure = _sys.modules.get('matplotlib.figure')
+
+    return figure is not None and isinstance(obj, figure.Figure)
+
+
+def is_pil_image(obj):
+    '''
+    whether obj is a PIL image, without importing PIL (see is_figure).
+    '''
+
+    image = _sys.modules.get('PIL.Image')
+
+    return image is not None and isinstance(obj, image.Image)
+
+
+def has_pygments():
+
+    return _importlib_util.find_spec('pygments') is not None
+
+
+# formats figures can be saved in, with their MIME type and file suffix
+_FIGURE_FORMATS = {'png':('image/png', '.png'), 'jpeg':('image/jpeg', '.jpg'),
+                   'svg':('image/svg+xml', '.svg')}
+
+
+def figure_to_bytes(fig:'matplotlib.figure.Figure', fig_format='png', dpi=None,
+                    quality=None, simplify=None):
+    """
+    Save a Matplotlib figure once, directly in fig_format (png, jpeg or svg),
+    and return the bytes. dpi defaults to that of savefig. quality is used for
+    jpeg and simplify (a threshold between 0 and 1) turns on path
+    simplification.
+    """
+
+    options = {} if dpi is None else {'dpi':dpi}
+    if fig_format == 'jpeg' and quality is not None:
+        options['pil_kwargs'] = {'quality':quality}
+
+    rc_params = {} if simplify is None else {'path.simplify':True,
+                                            'path.simplify_threshold':simplify}
+
+    import matplotlib
 
-def fig2img(fig: _plt.Figure):
-    """Convert a Matplotlib figure to a PIL Image and return it"""
     buf = _io.BytesIO()
-    fig.savefig(buf)
-    buf.seek(0)
-    img = _PIL.Image.open(buf)
-    return img
+    with matplotlib.rc_context(rc_params):
+        fig.savefig(buf, format=fig_format, **options)
+
+    return buf.getvalue()
 
 
-def image_to_byte_array(image:_PIL.Image):
+def image_to_byte_array(image:'PIL.Image.Image'):
     """Convert an Image to byte like array without saving to disk"""
     imgByteArr = _io.BytesIO()
     image.save(imgByteArr, format=image.format if image.format is not None
@@ -33,6 +84,75 @@ def image_to_byte_array(image:_PIL.Image):
     return imgByteArr
 
 
+# formats images can be transcoded to, with the PIL name of the format and the
+# suffix used for the file of the image
+_TRANSCODE_FORMATS = {'png':('PNG', '.png'), 'jpeg':('JPEG', '.jpg'),
+                      'webp':('WEBP', '.webp')}
+
+
+def image_mime_type(img_bytes:bytes, path=None):
+    '''
+    MIME type of an image given as bytes, read from its header by PIL or, for
+    formats PIL does not know (such as svg), guessed from the extension of
+    path. Defaults to image/png.
+    '''
+
+    from PIL import Image
+
+    try:
+        with Image.open(_io.BytesIO(img_bytes)) as image:
+            mime_type = Image.MIME.get(image.format)
+    except OSError:
+        mime_type = None
+
+    if mime_type is None and path is not None:
+        mime_type = _mimetypes.guess_type(str(path))[0]
+
+    return mime_type or 'image/png'
+
+
+def transcode_image(image:'PIL.Image.Image', size, image_format:str, quality=None):
+    '''
+    Resample image to size (each side is only ever shrunk) and encode it in
+    image_format which is one of png, jpeg or webp. quality is used by jpeg
+    and webp. Returns the encoded bytes.
+    '''
+
+    from PIL import Image
+
+    size = (max(1, min(size[0], image.size[0])), max(1, min(size[1], image.size[1])))
+
+    if size != image.size:
+        image = image.resize(size, Image.LANCZOS)
+
+    has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+
+    if image_format == 'jpeg' and image.mode not in ['RGB', 'L']:
+        if has_alpha:
+            # jpeg has no transparency, transparent parts are shown as white
+            image = image.convert('RGBA')
+            background = Image.new('RGBA', image.size, 'white')
+            image = Image.alpha_composite(background, image)
+
+        image = image.convert('RGB')
+    elif image_format == 'webp' and image.mode not in ['RGB', 'RGBA']:
+        image = image.convert('RGBA' if has_alpha else 'RGB')
+
+    options = {'optimize':True} if image_format != 'webp' else {}
+    if image_format != 'png' and quality is not None:
+        options['quality'] = quality
+
+    buffer = _io.BytesIO()
+    image.save(buffer, format=_TRANSCODE_FORMATS[image_format][0], **options)
+
+    return buffer.getvalue()
+
+
+def data_uri(data:bytes, mime_type:str):
+
+    return f'data:{mime_type};base64,{_b64.b64encode(data).decode("utf-8")}'
+
+
 def file_to_base64(filepath:str):
     """
     Returns the content of a file as a Base64 encoded string.
@@ -47,8 +167,30 @@ def file_to_base64(filepath:str):
 
 
 def html_tokenizer(html:str):
+    """
+    Split the html of a plot or a map into the tokens of its head (its script,
+    link, style and div elements) and its body.
+
+    This gives the same result as parsing it with BeautifulSoup (see
+    _html_tokenizer_bs4) but in a single pass over html without building a
+    parse tree, which is much faster for the multi-megabyte files produced by
+    plotly. html which can not be handled this way (see _tokenize_html) is
+    parsed with BeautifulSoup.
+    """
+
+    html_tokens = _tokenize_html(html)
 
-    html_soup = _bs(html, 'html.parser')
+    if html_tokens is None:
+        html_tokens = _html_tokenizer_bs4(html)
+
+    return html_tokens
+
+
+def _html_tokenizer_bs4(html:str):
+
+    from bs4 import BeautifulSoup
+
+    html_soup = BeautifulSoup(html, 'html.parser')
 
     head_html = str(html_soup.head)
     body_html = str(html_soup.body)
@@ -56,9 +198,9 @@ def html_tokenizer(html:str):
     if head_html:
         html_tokens['head'] = []
 
-        head_soup = _bs(head_html, 'html.parser')
+        head_soup = BeautifulSoup(head_html, 'html.parser')
 
-        for tag in ['script','link','style', 'div']:
+        for tag in _HEAD_TOKEN_TAGS:
             html_tokens['head']+= [str(elem) for elem in head_soup.find_all(tag)]
 
     html_tokens['body'] = body_html
@@ -66,13 +208,272 @@ def html_tokenizer(html:str):
     return html_tokens
 
 
+_HEAD_TOKEN_TAGS = ['script','link','style', 'div']
+# tags which BeautifulSoup treats as empty elements, strings inside which are
+# not stripped and attributes whose values are lists of whitespace separated
+# values
+_VOID_TAGS = {'area', 'base', 'br', 'col', 'embed', 'hr', 'img', 'input',
+              'keygen', 'link', 'menuitem', 'meta', 'param', 'source', 'track',
+              'wbr', 'basefont', 'bgsound', 'command', 'frame', 'image',
+              'isindex', 'nextid', 'spacer'}
+_PRESERVE_WHITESPACE_TAGS = {'pre', 'textarea'}
+_LIST_ATTRIBUTES = {'class', 'accesskey', 'dropzone', 'rel', 'rev', 'headers',
+                    'accept-charset', 'archive', 'sizes', 'sandbox', 'for'}
+_ASCII_SPACES = '\x20\x0a\x09\x0c\x0d'
+
+_START_TAG = _re.compile(r'<([a-zA-Z][^\t\n\r\f />\x00]*)((?:\s+[^\s"\'>/=]+(?:\s*=\s*(?:"[^"]*"|\'[^\']*\'))?)*)\s*(/?)>')
+_ATTRIBUTE = _re.compile(r'\s+([^\s"\'>/=]+)(?:\s*=\s*(?:"([^"]*)"|\'([^\']*)\'))?')
+_END_TAG = _re.compile(r'</([a-zA-Z][^\t\n\r\f />\x00]*)\s*>')
+_COMMENT = _re.compile(r'<!--(?![->])(.*?)-->', _re.DOTALL)
+_DOCTYPE = _re.compile(r'<!DOCTYPE[^<>]*>', _re.IGNORECASE)
+# end of the contents of a script or style element (or a comment inside it
+# which html.parser may treat differently depending on the python version)
+_RAW_TEXT_END = {'script':_re.compile(r'</script|<!--', _re.IGNORECASE),
+                 'style':_re.compile(r'</style|<!--', _re.IGNORECASE)}
+_NON_SPACE = _re.compile(r'[^\x20\x0a\x09\x0c\x0d]')
+
+
+def _tokenize_html(html:str):
+    """
+    Tokenizer used by html_tokenizer. It re-serializes the html the way
+    BeautifulSoup does (attributes sorted and double quoted, empty elements
+    closed with />, whitespace only strings collapsed) while scanning it once.
+    Anything whose serialization by BeautifulSoup would depend on the details
+    of its parser (entities, unquoted attributes, unbalanced tags, markup
+    inside scripts etc.) is not handled and None is returned instead.
+    """
+
+    pieces = []        # the re-serialized html
+    stack = []         # open elements as (name, index of their first piece)
+    elements = {}      # (start, end) pieces of head, body and head tokens
+    npreserve = 0      # number of open elements preserving whitespace
+    pos = 0
+
+    def add_text(text):
+
+        if '&' in text or '<' in text or '>' in text:
+            return False
+
+        if npreserve == 0 and text.strip(_ASCII_SPACES) == '':
+            text = '\n' if '\n' in text else ' '
+
+        pieces.append(text)
+
+        return True
+
+    def close(name, start):
+
+        in_head = any(x[0] == 'head' for x in stack)
+
+        if name in ['head', 'body']:
+            if name in elements:
+                return False
+            elements[name] = [(start, len(pieces))]
+        elif in_head and name in _HEAD_TOKEN_TAGS:
+            elements.setdefault(name, []).append((start, len(pieces)))
+
+        return True
+
+    while pos < len(html):
+
+        lt = html.find('<', pos)
+        if lt == -1:
+            lt = len(html)
+
+        if lt > pos and not add_text(html[pos:lt]):
+            return None
+
+        if lt == len(html):
+            break
+
+        if html.startswith('<!--', lt):
+            match = _COMMENT.match(html, lt)
+            if match is None:
+                return None
+            pieces.append(match.group())
+
+        elif html.startswith('</', lt):
+            match = _END_TAG.match(html, lt)
+            if match is None or len(stack)==0 or stack[-1][0] != match.group(1).lower():
+                return None
+
+            pieces.append(f'</{stack[-1][0]}>')
+            name, start = stack.pop()
+            npreserve -= name in _PRESERVE_WHITESPACE_TAGS
+            if not close(name, start):
+                return None
+
+        elif html.startswith('<!', lt):
+            match = _DOCTYPE.match(html, lt)
+            if match is None or len(stack)>0:
+                return None
+            pieces.append(match.group())
+
+        else:
+            match = _START_TAG.match(html, lt)
+            if match is None:
+                return None
+
+            name = match.group(1).lower()
+            attributes = {}
+
+            for attribute in _ATTRIBUTE.finditer(match.group(2)):
+                key = attribute.group(1).lower()
+                value = attribute.group(2) if attribute.group(2) is not None else attribute.group(3)
+                value = '' if value is None else value
+
+                if (key in attributes or any(x in value for x in '&<>"') or
+                    (key in _LIST_ATTRIBUTES and value != ' '.join(value.split()))):
+                    return None
+
+                attributes[key] = value
+
+            tag = f'<{name}' + ''.join(f' {key}="{attributes[key]}"' for key in sorted(attributes))
+            start = len(pieces)
+
+            if name in _VOID_TAGS:
+                pieces.append(tag + '/>')
+                if not close(name, start):
+                    return None
+            elif match.group(3) == '/':
+                pieces.append(tag + f'></{name}>')
+                if not close(name, start):
+                    return None
+            else:
+                pieces.append(tag + '>')
+                stack.append((name, start))
+                npreserve += name in _PRESERVE_WHITESPACE_TAGS
+
+                if name in _RAW_TEXT_END:
+                    end = _RAW_TEXT_END[name].search(html, match.end())
+                    if end is None or end.group() == '<!--':
+                        return None
+
+                    text = html[match.end():end.start()]
+
+                    if npreserve == 0 and text != '' and _NON_SPACE.search(text) is None:
+                        text = '\n' if '\n' in text else ' '
+                    if text != '':
+                        pieces.append(text)
+
+                    pos = end.start()
+                    continue
+
+        pos = match.end()
+
+    if len(stack)>0:
+        return None
+
+    html_tokens = {'head':[]}
+
+    for name in _HEAD_TOKEN_TAGS:
+        html_tokens['head'] += [''.join(pieces[start:end]) for start, end in
+                                sorted(elements.get(name, []))]
+
+    if 'body' in elements:
+        start, end = elements['body'][0]
+        html_tokens['body'] = ''.join(pieces[start:end])
+    else:
+        html_tokens['body'] = 'None'
+
+    return html_tokens
+
+
+def html_is_blank(html:str):
+    """
+    Whether html shows no text, that is whether
+
+        BeautifulSoup(html, 'html.parser').get_text().strip('\\n').strip(' ') == ''
+
+    which is computed without parsing html into a soup unless it contains
+    entities, comments, raw text or whitespace preserving elements.
+    """
+
+    if '&' in html or '<!' in html or _re.search(r'<(script|style|pre|textarea)', html, _re.I):
+        return _html_is_blank_bs4(html)
+
+    strings = []
+    pos = 0
+
+    while pos < len(html):
+        lt = html.find('<', pos)
+        if lt == -1:
+            lt = len(html)
+
+        if lt > pos:
+            text = html[pos:lt]
+            if text.strip(_ASCII_SPACES) == '':
+                text = '\n' if '\n' in text else ' '
+            strings.append(text)
+
+        if lt == len(html):
+            break
+
+        match = _END_TAG.match(html, lt) or _START_TAG.match(html, lt)
+        if match is None:
+            return _html_is_blank_bs4(html)
+
+        pos = match.end()
+
+    return ''.join(strings).strip('\n').strip(' ') == ''
+
+
+def _html_is_blank_bs4(html:str):
+
+    from bs4 import BeautifulSoup
+
+    soup = BeautifulSoup(html, 'html.parser')
+
+    return soup.get_text().strip('\n').strip(' ') == ''
+
+
+_PLOTLYJS_CONFIG = _re.compile(r'<script[^>]*>\s*window\.PlotlyConfig = [^<]*</script>\s*')
+_PLOTLYJS_BUNDLE = _re.compile(r'<script[^>]*>(/\*\*\s*\* plotly\.js v(\d+)\.(\d+)\.(\d+).*?)</script>',
+                               _re.DOTALL)
+
+def split_plotlyjs(html:str):
+    """
+    Find the plotly.js bundle embedded (when plots are saved with
+    include_plotlyjs=True) in the html of a plotly plot.
+
+    Returns the html with the bundle and the PlotlyConfig script preceding it
+    removed, the version of plotly.js as a tuple of ints and the source of
+    the bundle. If there is no bundle, html is returned as it is along with
+    None, None.
+    """
+
+    match = _PLOTLYJS_BUNDLE.search(html)
+
+    if match is None:
+        return html, None, None
+
+    start, end = match.span()
+    config = None
+
+    for config in _PLOTLYJS_CONFIG.finditer(html, 0, start):
+        pass
+
+    if config is not None and config.end() == start:
+        start = config.start()
+
+    version = tuple(int(x) for x in match.groups()[1:])
+
+    return html[:start] + html[end:], version, match.group(1)
+
+
 def replace_leading_spaces(source, char="&nbsp;"):
     stripped = source.lstrip()
     return char * (len(source) - len(stripped)) + stripped
 
 
+@_functools.lru_cache(maxsize=1024)
 def format_text(text, parent_depth, leading_space="&nbsp;", is_code=False,
                 formatted=False):
+    '''
+    Indent the lines of text by the depth of its parent and mark its line
+    breaks. Results are cached since the same paragraphs are often formatted
+    many times.
+    '''
 
     if len(text)>0 and text[0]=='\n':
         text = text[1:]
@@ -93,75 +494,120 @@ def format_text(text, parent_depth, leading_space="&nbsp;", is_code=False,
         line_char = ''
 
     text_split = split_by_text_newspace(text)
-    indel_lengths = [len(text_part)-len(text_part.lstrip()) for text_part
-                 in text_split if not all(x in ' ' for x in text_part) and text_part != '']
 
-    if len(indel_lengths)==0:
-        min_indel = 0
-    else:
-        min_indel = min(indel_lengths)
+    # parts which are only spaces are emptied, the rest keep their indentation
+    # relative to the least indented of them
+    indel_lengths = [len(part)-len(part.lstrip()) for part in text_split
+                     if part.strip(' ') != '']
+    min_indel = min(indel_lengths, default=0)
 
-    text_split = [part[min_indel:] if any(x not in ['',' '] for x in part[min_indel:])
-                  else '' for part in text_split]
-    text_split = [replace_leading_spaces(part, char=leading_space)
-                  for part in text_split]
-    text_split = [part + '<br>' if _is_item(part) and
-                  (ind==len(text_split)-1 or _is_item(text_split[ind+1]))
-                  else part for ind,part in enumerate(text_split)]
+    parts = []
+    for part in text_split:
+        part = part[min_indel:]
+        parts.append(replace_leading_spaces(part, char=leading_space)
+                     if part.strip(' ') != '' else '')
 
-    if all(x == ' ' for x in text_split[-1]):
-        text_split = text_split[:-1]
+    is_item = [_is_item(part) for part in parts] + [True]
+    if parts[-1].strip(' ') == '':
+        parts.pop()
 
     total_indel = '    '*(parent_depth + fixed_indel)
 
-    text = '\n'.join([total_indel + x + f'{line_char}' if x=='' or all(y == ' ' for y in x)
-                      else total_indel + x + f'{end_char}' for x in text_split])
+    lines = []
+    for ind,part in enumerate(parts):
+        if part.strip(' ') == '':
+            lines.append(total_indel + part + line_char)
+        elif is_item[ind] and is_item[ind+1]:
+            lines.append(total_indel + part + '<br>' + end_char)
+        else:
+            lines.append(total_indel + part + end_char)
 
-    return text
+    return '\n'.join(lines)
 
 
-def split_by_text_newspace(text):
+def _prettify_classes():
     '''
-    split text by newspace which are not inside quotes.
+    classes of code-prettify (which the code styles in config/css are written
+    for) of pygments token types. Text and whitespace are not put in spans.
     '''
 
-    open_quotes = []
-    new_space_positions = [-1]
-    new_text = text
-    offset = 0
+    from pygments import token
 
-    for pos,let in enumerate(text):
-        if let == '"':
-            if len(open_quotes)>0 and  open_quotes[-1] == '"':
-                open_quotes.pop()
-            else:
-                open_quotes.append('"')
+    return {token.Token:'pln', token.Text:None, token.Whitespace:None,
+            token.Comment:'com', token.String:'str', token.Number:'lit',
+            token.Literal:'lit', token.Keyword:'kwd', token.Keyword.Type:'typ',
+            token.Name:'pln', token.Name.Class:'typ', token.Name.Builtin:'typ',
+            token.Name.Exception:'typ', token.Name.Decorator:'dec',
+            token.Name.Tag:'tag', token.Name.Attribute:'atn',
+            token.Operator:'pun', token.Punctuation:'pun'}
 
-        if let == '\n' and len(open_quotes)==0:
-            new_space_positions.append(pos-offset)
-        elif let == '\n' and len(open_quotes)>0:
-            new_text = text[:pos] + '' + text[pos+1:]
-            offset += 1
 
-    text = new_text
-    new_space_positions.append(len(text))
+@_functools.lru_cache(maxsize=1024)
+def highlight_code(code:str, language:str):
+    '''
+    Highlight code with pygments into the spans code-prettify would create.
+    Returns the html of each line, the spans of a token spanning several lines
+    are closed at the end of each line. Results are cached since the same code
+    is often rendered many times.
+    '''
+
+    from pygments import lexers
 
-    split_text = []
-    counter = 0
+    lexer = lexers.get_lexer_by_name(language, stripnl=False, ensurenl=False)
+    classes = _prettify_classes()
+    lines = [[]]
 
-    for ind_pair,(pos1,pos2) in enumerate(zip(new_space_positions[0:-1], new_space_positions[1:])):
-        pos1 -= counter
-        pos2 -= counter
+    for token_type, value in lexer.get_tokens(code):
+        while token_type not in classes:
+            token_type = token_type.parent
 
-        text_part = text[pos1+1:pos2]
-        text = text[pos2+1:]
+        for i, part in enumerate(value.split('\n')):
+            if i>0:
+                lines.append([])
+            if part == '':
+                continue
+
+            part = _html.escape(part, quote=False)
+
+            if classes[token_type] is None:
+                lines[-1].append(part)
+            else:
+                lines[-1].append(f'<span class="{classes[token_type]}">{part}</span>')
+
+    return tuple(''.join(line) for line in lines)
+
+
+_QUOTE_OR_NEWSPACE = _re.compile('["\n]')
+
+def split_by_text_newspace(text):
+    '''
+    split text by newspace which are not inside quotes in a single pass over
+    the quotes and newspaces. Only the last newspace inside quotes is removed
+    from the text while the positions of the newspaces after them are shifted
+    by all of them.
+    '''
 
-        counter += pos2+1
+    in_quotes = False
+    new_space_positions = [-1]
+    quoted_position = None
+    offset = 0
 
-        split_text.append(text_part)
+    for match in _QUOTE_OR_NEWSPACE.finditer(text):
+        pos = match.start()
+        if match.group() == '"':
+            in_quotes = not in_quotes
+        elif in_quotes:
+            quoted_position = pos
+            offset += 1
+        else:
+            new_space_positions.append(pos-offset)
 
-    return split_text
+    if quoted_position is not None:
+        text = text[:quoted_position] + text[quoted_position+1:]
+    new_space_positions.append(len(text))
 
+    return [text[pos1+1:pos2] for pos1,pos2 in
+            zip(new_space_positions[:-1], new_space_positions[1:])]
 
 
 def _is_item(part):
@@ -177,14 +623,55 @@ def _is_item(part):
     else: return False
 
 
-def _class(query_iter):
+# inferred types (see pandas.api.types.infer_dtype) of object columns all
+# elements of which are numbers
+_NUMBER_INFERRED_TYPES = {'integer', 'floating', 'mixed-integer-float'}
+
+def _class(column):
+    '''
+    html class of the cells of a table column which is num if every cell is a
+    number or a string of a number. This is decided by the dtype of the column
+    and only the object columns are looked at element by element.
+    '''
 
-    if all((isinstance(x,str) and _is_str_num(x)) or
-           isinstance(x, Number) for x in query_iter):
+    if len(column) == 0 or _is_num_column(column):
         return 'class="num"'
     else:
         return ''
 
+def _is_num_column(column):
+
+    import numpy as np
+    import pandas as pd
+
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind != 'O':
+        return column.dtype.kind in 'biufc'
+
+    if isinstance(column.dtype, (np.dtype, pd.StringDtype)):
+        values = column.to_numpy(dtype=object)
+    else:
+        # elements of other extension arrays as the column gives them
+        values = np.fromiter(column, dtype=object, count=len(column))
+
+    inferred_type = pd.api.types.infer_dtype(values, skipna=False)
+
+    if inferred_type in _NUMBER_INFERRED_TYPES:
+        return True
+    elif inferred_type == 'string':
+        # converts with float so it accepts exactly the strings _is_str_num does
+        try:
+            values.astype(float)
+            return True
+        except ValueError:
+            return False
+    else:
+        return _is_num_items(values)
+
+def _is_num_items(query_iter):
+
+    return all((isinstance(x,str) and _is_str_num(x)) or
+               isinstance(x, Number) for x in query_iter)
+
 def _is_str_num(string):
 
     try:
@@ -7,6 +7,7 @@ Created on Wed Jan 26 17:08:51 2022
 """
 
 import inspect as _gadget
+import io as _pyio
 import json as _js
 import pydoc as _pyd
 import os as _os
@@ -95,27 +96,37 @@ def from_json(jdict_path=None, _jdict=None, _parent=None):
         obj_type = _jdict['type']
         raise ValueError(f'Could not find object of type {obj_type}')
 
-    init_argspec = [x for x in _gadget.getfullargspec(obj_type.__init__)[0] #  get all arguments required for init
-               if x not in ['self']]                                        #  except self
+    init_params = _gadget.signature(obj_type.__init__).parameters   #  get all arguments required for init
+    init_argspec = [x for x in init_params if x not in ['self']]        #  except self
 
 
-    init_args = {x:_jdict['_'+x] for x in init_argspec if x!='parent'}  # get the values for these arguments which will be stored
-                                                                        # in the dict, except the parent which should be either None
-                                                                        # if the function is called by the user else initialized internally
+    init_args = {x:_jdict['_'+x] for x in init_argspec                  # get the values for these arguments which will be stored
+                 if x!='parent' and ('_'+x in _jdict or                 # in the dict, except the parent which should be either None
+                     init_params[x].default is _gadget.Parameter.empty)} # if the function is called by the user else initialized internally
+                                                                        # arguments added after the json was saved get their defaults
     if 'parent' in init_argspec:
         init_args['parent'] = _parent                                   # if a parent is supplied to from_json call during addition of childs
                                                                         # it will be included here in the init args
 
     node = obj_type(**init_args)  #  initiate the object
 
+    fields = obj_type._fields()
+
     for attr in _jdict:
-        if attr not in ['type','_is_root','_depth','_has_tabs',         # set attrs which may have been changed after initialization
-                        '_has_grid','_children']:                       # note: child parent relations might change so they will be
+        if attr in fields:                                              # set attrs which may have been changed after initialization
+                                                                        # note: child parent relations might change so they will be
                                                                         # taken care of automatically when children are created in this
+                                                                        # (other keys such as type and _children, or bookkeeping saved by
+                                                                        # older versions, are not fields of the node)
 
+            value = _jdict[attr]
 
+            if attr == '_CONFIG':                                       # entries added to the config after the json was saved
+                value = {**node._CONFIG,                                # are taken from the current config
+                         **{section:{**node._CONFIG.get(section, {}), **items}
+                            for section, items in value.items()}}
 
-            node.__setattr__(attr, _jdict[attr])
+            node.__setattr__(attr, value)
 
 
     for child in _jdict['_children']:           # now recursively do the same for every child of this object
@@ -149,8 +160,34 @@ def to_json(node, path):
         fp.writelines(json_str)
 
 
+def html_writer(sink, encoding='utf-8'):
+
+    '''
+    Given a file-like sink, returns a function that writes str fragments of
+    html into it. Text sinks (files opened with 'w', StringIO, sys.stdout,
+    gzip.open(..., 'wt')) are written to directly, binary sinks (files opened
+    with 'wb', BytesIO, GzipFile) and sockets receive the encoded fragments.
+    '''
+
+    if isinstance(sink, _pyio.TextIOBase):
+        return sink.write
+
+    if (isinstance(sink, (_pyio.RawIOBase, _pyio.BufferedIOBase)) or
+        'b' in str(getattr(sink, 'mode', ''))):
+        return lambda fragment: sink.write(fragment.encode(encoding))
+
+    if hasattr(sink, 'sendall'):
+        return lambda fragment: sink.sendall(fragment.encode(encoding))
+
+    if hasattr(sink, 'write'):
+        return sink.write
+
+    raise ValueError(f'sink should be a file-like object or a socket but is {type(sink)}')
+
+
 def to_ascii(node, detailed=True, print_address=False,  _depth=None,
-             _print_root=None, formatting='terminal', link_to_sections=False):
+             _print_root=None, formatting='terminal', link_to_sections=False,
+             ctx=None):
 
     formatter = _FORMATTERS[formatting]
     tag0 = formatter['tag'][0]
@@ -159,7 +196,6 @@ def to_ascii(node, detailed=True, print_address=False,  _depth=None,
     if _depth is None:
         _depth = 0
 
-    indent = ''
     if _print_root is None:
         _print_root = node
 
@@ -168,72 +204,125 @@ def to_ascii(node, detailed=True, print_address=False,  _depth=None,
     else:
         section_only=True
 
+    if not isinstance(node,(pr.containers.Report, pr.containers.Section)) and not detailed:
+        return tag0*int(_depth==0) + '' + tag1*int(_depth==0)
 
-    if isinstance(node,(pr.containers.Report, pr.containers.Section)) or detailed:
+    # the tree is walked with a stack of iterators over the children of each
+    # level, path holds the ancestors (starting from the print root) of the
+    # nodes given by the iterator at the top of the stack
+    path = node._ancestors(until=_print_root)[:-1]
+    top_last = _last_descendant(node._root(until=_print_root), section_only)
+    last = _last_descendant(_print_root, section_only)
+    stack = [iter((node,))]
+    node_strs = []
 
-        node_type = str(type(node))[8:-2].split('.')[-1].upper()
+    # section numbers are taken from a render context which computes them in
+    # one pass, the last (section) child of each node is kept once found
+    if link_to_sections and ctx is None:
+        ctx = pr._render.RenderContext(node._root())
 
-        if node_type == 'SECTION':
-            if node._is_subsection:
-                node_type = formatter['bolden']('SUBSECTION')
-            else:
-                node_type = formatter['bolden'](node_type)
-        elif node_type =='REPORT':
-            node_type = formatter['bolden'](node_type)
+    section_no_str = None if ctx is None else ctx.section_no_str
+    last_children = {}
 
-        ancestors = node._ancestors(until=_print_root)
+    def last_child(parent):
 
-        if node != node._root(until=_print_root)._descendants(section_only=section_only)[-1]:
-            for ind in range(len(ancestors)-2):
-                if ( (detailed and ancestors[ind]._children[-1] != ancestors[ind+1])
-                    or (not detailed and len(ancestors[ind].sections)!=0 and ancestors[ind].sections[-1] != ancestors[ind+1])
-                    ):
-                    indent += '│   '
-                else:
-                    indent += '    '
-        else:
-            indent += '    '*(_depth-1)
+        if parent not in last_children:
+            children = parent._children if detailed else getattr(parent, 'sections', ())
+            last_children[parent] = children[-1] if len(children)>0 else None
 
-        if (node._parent is None
-            or (not detailed and (len(node._parent.sections)==0 or node != node._parent.sections[-1]))
-            or (detailed and (len(node._parent._children)==0 or node != node._parent._children[-1]))
-            ):
-            indent += '├───'*int(_depth>0)
-        else:
-            indent += '└───'*int(_depth>0)
+        return last_children[parent]
 
+    while len(stack)>0:
+        child = next(stack[-1], None)
 
-        node_str = hex(id(node))*print_address + ' ' + indent + f'{node_type}'
+        if child is None:
+            stack.pop()
+            if len(stack)>0:
+                path.pop()
+            continue
 
-        if isinstance(node, (pr.containers.Section,pr.containers.Report)):
+        if not isinstance(child,(pr.containers.Report, pr.containers.Section)) and not detailed:
+            continue
 
-            if isinstance(node, pr.containers.Section) and link_to_sections:
-                title = f'<a href="#S{node._section_no_str}">{node._title}</a>'
-            else:
-                title = node._title
+        depth = _depth + len(stack) - 1
 
-            node_str += f' ({title})'*(not print_address)
+        node_strs.append(_ascii_line(child, path + [child], depth,
+                                     top_last if child is node else last,
+                                     print_address, formatter, section_no_str,
+                                     last_child))
+
+        if len(child._children)>0:
+            path.append(child)
+            stack.append(iter(child._children))
+
+    if _depth==0:
+        node_strs[0] = tag0 + node_strs[0]
+
+    return ''.join(node_strs) + tag1*int(_depth==0)
 
-        if _depth==0:
-            node_str = tag0 + node_str + '\n'
-        else:
-            node_str += '\n'
 
+def _ascii_line(node, ancestors, depth, last, print_address, formatter,
+                section_no_str, last_child):
+    '''
+    The line of node in the tree drawn by to_ascii. ancestors are those of the
+    node starting from the node the tree is drawn for and last is the last
+    node in the tree. last_child gives the last child drawn in the tree of a
+    node and section_no_str, if given, the section numbers to link to.
+    '''
 
-        if len(node._children)==0:
+    indent = ''
+    node_type = str(type(node))[8:-2].split('.')[-1].upper()
 
-            return node_str + tag1*int(_depth==0)
+    if node_type == 'SECTION':
+        if node._is_subsection:
+            node_type = formatter['bolden']('SUBSECTION')
         else:
-            for child in node._children:
-                node_str += to_ascii(child, detailed=detailed, print_address=print_address,
-                                     _depth = _depth+1, _print_root=_print_root,
-                                     formatting=formatting,
-                                     link_to_sections=link_to_sections)
+            node_type = formatter['bolden'](node_type)
+    elif node_type =='REPORT':
+        node_type = formatter['bolden'](node_type)
 
-            return node_str + tag1*int(_depth==0)
+    if node != last:
+        for ind in range(len(ancestors)-2):
+            if last_child(ancestors[ind]) not in (None, ancestors[ind+1]):
+                indent += '│   '
+            else:
+                indent += '    '
+    else:
+        indent += '    '*(depth-1)
 
+    if node._parent is None or node != last_child(node._parent):
+        indent += '├───'*int(depth>0)
     else:
-       return tag0*int(_depth==0) + '' + tag1*int(_depth==0)
+        indent += '└───'*int(depth>0)
+
+
+    node_str = hex(id(node))*print_address + ' ' + indent + f'{node_type}'
+
+    if isinstance(node, (pr.containers.Section,pr.containers.Report)):
+
+        if isinstance(node, pr.containers.Section) and section_no_str is not None:
+            title = f'<a href="#S{section_no_str[node]}">{node._title}</a>'
+        else:
+            title = node._title
+
+        node_str += f' ({title})'*(not print_address)
+
+    return node_str + '\n'
+
+
+def _last_descendant(node, section_only):
+    '''
+    The last node of the subtree of node in pre-order (that is the last of
+    node._descendants(section_only)).
+    '''
+
+    while True:
+        children = getattr(node, 'sections', ()) if section_only else node._children
+
+        if len(children)==0:
+            return node
+
+        node = children[-1]
 
 
 def _to_dict(node):
@@ -245,14 +334,18 @@ def _to_dict(node):
 
     assert isinstance(node,pr.objects._Node),f'node should be a _Node but was {type(node)}'
 
-    keys = [x for x in node.__dict__.keys()
-               if x not in ['_parent']]
+    keys = [x for x in node._fields() if hasattr(node, x)]
 
     node_dict = {}
 
     node_dict['type'] = str(type(node))[8:-2]   # needs to be saved as str for JSON serializability
     for key in keys: node_dict[key]=node.__getattribute__(key)
 
+    if '_CONFIG' in node_dict:
+        # the sections of the config are views of the cached config
+        node_dict['_CONFIG'] = {section:dict(items) for section,items
+                                in node_dict['_CONFIG'].items()}
+
     node_dict['_children'] = []
 
     for child in node._children:
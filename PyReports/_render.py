@@ -0,0 +1,762 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Created on Sun Oct 18 17:31:05 2026
+
+Internal machinery used while rendering a report to html. Nothing in here is
+meant to be used by the end user.
+
+"""
+
+import io as _pyio
+import os as _os
+import re as _re
+import hashlib as _hashlib
+import pathlib as _pathlib
+import random as _rand
+import asyncio as _asyncio
+import threading as _threading
+import urllib.parse as _urlparse
+import concurrent.futures as _futures
+
+import PyReports as pr
+
+
+class RenderContext():
+    '''
+    Positional information of the nodes of a report that is needed while
+    rendering: depth of every node, section number strings of sections, global
+    tab item ids and names of tabs and names of folds.
+
+    Computing these on the fly requires each node to walk up to the root or
+    rescan the list of all tabs/folds of the report which makes rendering
+    quadratic in the number of nodes. Instead they are computed here once in a
+    single pre-order traversal of the tree and the _generate_html/_write_html
+    methods of the nodes read them from the context.
+    '''
+
+    def __init__(self, root, cache=False, dedup_assets=False, assets=None):
+
+        self.root = root
+        self.cache = cache
+        self.assets = assets
+        self.depth = {}
+        self.section_no_str = {}
+        self.tab_item_ids = {}
+        self.tab_name = {}
+        self.fold_name = {}
+        self.offsets = {}
+        self.shared_assets = {}
+        self.asset_signature = {}
+        self.plotly_requirements = {}
+        self.plotly_bundles = {}
+        self.plotly_version = None
+        self.plotly_versions_mixed = False
+        self.html_tokens = {} # of plots, see Plot._html_tokens
+        self.dependencies = Dependencies()
+        self.reader = None
+
+        self._executor = None
+        self._pool_nodes = []
+        self._pool_next = 0
+        self._pool_window = 0
+        self._futures = {}
+
+        if root is not None:
+            self._build(root)
+
+            if dedup_assets:
+                self._share_assets(root.iter_descendants())
+
+
+    def start_pool(self, executor, nodes, window):
+        '''
+        Render nodes (which should be given in document order) in the worker
+        processes of executor. At most window of them are rendered ahead of
+        the node that is currently being written so that finished fragments do
+        not pile up in memory. Nodes whose cached fragment is still valid are
+        not sent to the pool.
+        '''
+
+        self._executor = executor
+        self._pool_nodes = [node for node in nodes
+                            if not self._is_cached(node) and not self.is_reference(node)]
+        self._pool_next = 0
+        self._pool_window = window
+        self._futures = {}
+
+        self._fill_pool()
+
+
+    def stop_pool(self):
+
+        for _, future in self._futures.values():
+            future.cancel()
+
+        self._executor = None
+        self._pool_nodes = []
+        self._futures = {}
+
+
+    def _fill_pool(self):
+
+        while (self._pool_next < len(self._pool_nodes) and
+               len(self._futures) < self._pool_window):
+
+            node = self._pool_nodes[self._pool_next]
+            future = self._executor.submit(_render_detached, *self._detached(node))
+
+            self._futures[node] = (self._pool_next, future)
+            self._pool_next += 1
+
+
+    def _detached(self, node):
+        '''
+        Return a detached copy of node (see _Node._detached_copy) along with
+        a context for rendering it which contains only what is needed for
+        that, so that both can be sent to a worker process.
+        '''
+
+        copy = node._detached_copy()
+
+        ctx = RenderContext(None, assets=self.assets)
+        ctx.depth[copy._parent] = self.depth[node._parent]
+        ctx.depth[copy] = self.depth[node]
+        ctx.plotly_version = self.plotly_version
+
+        if node in self.shared_assets:
+            ctx.shared_assets[copy] = self.shared_assets[node]
+
+        if node in self.html_tokens:
+            ctx.html_tokens[copy] = self.html_tokens.pop(node)
+
+        return copy, ctx
+
+
+    def _pooled_html(self, node):
+        '''
+        Return the html of node rendered by the pool. Nodes scheduled before
+        node but never asked for (because an ancestor of theirs was cached)
+        are cancelled. If the node could not be rendered in the pool (for
+        instance because it could not be pickled) it is rendered here, so a
+        genuine error is raised from this process.
+        '''
+
+        index, future = self._futures.pop(node)
+
+        for other in [x for x, (i, _) in self._futures.items() if i < index]:
+            self._futures.pop(other)[1].cancel()
+
+        try:
+            html = future.result()
+        except Exception:
+            html = node._generate_html(self)
+
+        self._fill_pool()
+
+        return html
+
+
+    def read_bytes(self, path):
+        '''
+        Return the contents of the file at path. Every file read while
+        rendering goes through here so that when the report is rendered with
+        to_html_async the contents can come from the AssetReader which read
+        them ahead of time.
+        '''
+
+        if self.reader is not None:
+            return self.reader.read(path)
+
+        return _read_file(path)
+
+
+    def read_text(self, path):
+        '''
+        Return the contents of the file at path decoded the same way
+        open(path).read() would decode them.
+        '''
+
+        return _pyio.TextIOWrapper(_pyio.BytesIO(self.read_bytes(path))).read()
+
+
+    def _is_cached(self, node):
+
+        cached = node._render_cache.get('html')
+
+        return (not node._dirty and cached is not None and
+                cached[0] == self.signature(node))
+
+
+    def signature(self, node):
+        '''
+        Everything about the position of node in the report that its html
+        depends on (apart from the node itself and its descendants). If this
+        does not change and the node is not dirty then its html from the
+        previous render is still valid.
+
+        For nodes which contain tabs or folds this includes the tab and fold
+        counts preceding them in the report, since the ids and names of their
+        tabs and folds are derived from these.
+        '''
+
+        assets_directory = None if self.assets is None else self.assets.directory
+        plotly_version = (self.plotly_version, self.plotly_versions_mixed) \
+            if node._count(pr.objects.Plot)>0 else None
+
+        return (self.depth[node], self.offsets.get(node),
+                self.asset_signature.get(node), assets_directory, plotly_version)
+
+
+    def require_plotlyjs(self, version, source):
+        '''
+        Called by plots (while registering their dependencies) that need
+        plotly.js of version (a tuple of ints). source is the path of a plot
+        which embeds this version or None for the version which comes with
+        the installed plotly package.
+        '''
+
+        count, first_source = self.plotly_requirements.get(version, (0, source))
+        self.plotly_requirements[version] = (count + 1, first_source)
+
+
+    def choose_plotlyjs(self):
+        '''
+        Choose the plotly.js to include in the head of the report once all the
+        plots registered their requirements. This is the latest version among
+        those required for the major version required by most plots (plotly.js
+        is backwards compatible within a major version). Plots which require
+        another major version keep their own bundle, see Plot._body_html.
+        '''
+
+        if len(self.plotly_requirements)==0:
+            return
+
+        counts = {}
+        for version, (count, _) in self.plotly_requirements.items():
+            counts[version[0]] = counts.get(version[0], 0) + count
+
+        major = max(counts, key=lambda x: (counts[x], x))
+        version = max(x for x in self.plotly_requirements if x[0] == major)
+        source = self.plotly_requirements[version][1]
+
+        bundle = self.plotly_bundles.get(version)
+
+        if bundle is None and source is None:
+            import plotly.offline
+            bundle = plotly.offline.get_plotlyjs()
+        elif bundle is None:
+            # the plot was read in a previous render (cache=True)
+            html = _pyio.TextIOWrapper(_pyio.BytesIO(_read_file(source))).read()
+            bundle = pr._internal.split_plotlyjs(html)[2]
+
+        self.plotly_bundles = {version:bundle}
+        self.plotly_version = version
+        self.plotly_versions_mixed = len(counts)>1
+
+        self.dependencies.add(self.plotlyjs_script())
+
+
+    def plotlyjs_script(self):
+        '''
+        The html for the plotly.js chosen by choose_plotlyjs.
+        '''
+
+        if self.plotly_version is None:
+            return ''
+
+        bundle = self.plotly_bundles[self.plotly_version]
+
+        script_html = '    <script type="text/javascript">window.PlotlyConfig = {MathJaxConfig: \'local\'};</script>\n'
+        script_html += f'    <script type="text/javascript">{bundle}</script>\n'
+
+        if self.plotly_versions_mixed:
+            script_html += '    <script type="text/javascript">window.PyReportsPlotly = window.Plotly;</script>\n'
+
+        if self.assets is not None:
+            script_html = self.assets.externalize_scripts(script_html)
+
+        return script_html
+
+
+    def is_reference(self, node):
+        '''
+        Whether node embeds an asset which an earlier node in the report
+        already embeds, in which case it only refers to that asset and does
+        not need to read or encode it.
+        '''
+
+        return node in self.shared_assets and not self.shared_assets[node][1]
+
+
+    def _share_assets(self, nodes):
+        '''
+        Find the nodes (given in document order) which embed the same asset
+        (see _Node._shared_asset). Each asset shared by several nodes gets an
+        id of the form ASSET-n; the first node embedding it is rendered
+        normally (marked with the id) and later ones only refer to it by id.
+
+        Files are compared by content, but only those which are not
+        identified by their size or path alone are actually read and hashed.
+        Any other source (figures, images) is compared by identity.
+
+        Since the html of a node now depends on which of the nodes below it
+        are shared, this is also recorded in asset_signature which is a part
+        of the signature of the node used for caching.
+        '''
+
+        sources = [(node, node._shared_asset(self)) for node in nodes]
+        sources = [(node, source) for node, source in sources if source is not None]
+
+        sizes = {}
+        real_paths = {}
+
+        for _, (source, _) in sources:
+            if _is_path(source) and str(source) not in real_paths:
+                real_path = _os.path.realpath(str(source))
+                real_paths[str(source)] = real_path
+                sizes.setdefault(_os.path.getsize(real_path), set()).add(real_path)
+
+        content_keys = {}
+
+        def content_key(source):
+
+            if not _is_path(source):
+                return ('object', id(source))
+
+            real_path = real_paths[str(source)]
+
+            if real_path not in content_keys:
+                if len(sizes[_os.path.getsize(real_path)]) == 1:
+                    content_keys[real_path] = ('file', real_path)
+                else:
+                    content_keys[real_path] = ('sha256', _hashlib.sha256(_read_file(real_path)).hexdigest())
+
+            return content_keys[real_path]
+
+        keys = [(node, (content_key(source), params)) for node, (source, params) in sources]
+
+        counts = {}
+        for _, key in keys:
+            counts[key] = counts.get(key, 0) + 1
+
+        asset_ids = {}
+        for node, key in keys:
+            if counts[key] < 2:
+                continue
+
+            first = key not in asset_ids
+            if first:
+                asset_ids[key] = f'ASSET-{len(asset_ids)}'
+
+            self.shared_assets[node] = (asset_ids[key], first)
+
+            for ancestor in node.iter_ancestors():
+                self.asset_signature.setdefault(ancestor, []).append(self.shared_assets[node])
+
+        self.asset_signature = {node:tuple(signature) for node, signature in self.asset_signature.items()}
+
+
+    def fragment(self, node):
+        '''
+        Return the html of node, reusing the fragment cached in the previous
+        render if the node is not dirty and its position in the report has not
+        changed. When rendering with cache=True, the freshly rendered fragment
+        is stored in the node so that later renders can reuse it.
+        '''
+
+        signature = self.signature(node)
+
+        if self._is_cached(node):
+            return node._render_cache['html'][1]
+
+        if node in self._futures:
+            html = self._pooled_html(node)
+        else:
+            html = node._generate_html(self)
+
+        if self.cache:
+            node._cache_render_product('html', (signature, html))
+        elif 'html' in node._render_cache:
+            del node._render_cache['html']
+
+        for descendant in node.iter_descendants():
+            pr.objects._setattr(descendant, '_dirty', False)
+
+        return html
+
+
+    def _build(self, root):
+
+        Section = pr.containers.Section
+        Tab = pr.containers.Tab
+        Fold = pr.containers.Fold
+
+        ntab_items = 0   # total number of tab items seen so far in the report
+        ntabs = {}       # number of tabs seen so far in each root section
+        nfolds = {}      # number of folds seen so far in each root section
+
+        self.depth[root] = 0
+        if isinstance(root, Section):
+            self.section_no_str[root] = '1'
+
+        # each element of the stack is a node along with the top most section
+        # containing it (i.e. the section which is a child of the report),
+        # that is the section used for naming tabs and folds
+        root_section = root if isinstance(root, Section) else None
+        stack = [(root, root_section)]
+
+        while len(stack)>0:
+
+            node, root_section = stack.pop()
+            depth = self.depth[node]
+
+            if node._count(Tab)>0 or node._count(Fold)>0:
+                root_section_no_str = (None if root_section is None
+                                       else self.section_no_str[root_section])
+                self.offsets[node] = (ntab_items, root_section_no_str,
+                                      ntabs.get(root_section, 0),
+                                      nfolds.get(root_section, 0))
+
+            if isinstance(node, Tab) or isinstance(node, Fold):
+                if root_section is None:
+                    raise ValueError(f'{repr(node)} should be placed inside a Section.')
+
+                section_no_str = self.section_no_str[root_section]
+
+                if isinstance(node, Tab):
+                    self.tab_item_ids[node] = list(range(ntab_items, ntab_items + len(node._children)))
+                    ntab_items += len(node._children)
+
+                    tab_index = ntabs.get(root_section, 0)
+                    ntabs[root_section] = tab_index + 1
+                    self.tab_name[node] = f'TAB-{section_no_str}-{tab_index}'
+                else:
+                    fold_index = nfolds.get(root_section, 0)
+                    nfolds[root_section] = fold_index + 1
+                    self.fold_name[node] = f'FOLD-{section_no_str}-{fold_index}'
+
+            section_no = 0
+            children = []
+
+            for child in node._children:
+
+                self.depth[child] = depth + 1
+                child_root_section = root_section
+
+                if isinstance(child, Section):
+                    section_no += 1
+
+                    if isinstance(node, Section):
+                        self.section_no_str[child] = f'{self.section_no_str[node]}.{section_no}'
+                    else:
+                        self.section_no_str[child] = str(section_no)
+                        child_root_section = child
+
+                children.append((child, child_root_section))
+
+            stack += reversed(children)
+
+
+class Dependencies():
+    '''
+    Ordered set of the scripts (and styles) which a report needs, collected
+    during the rendering (see _Node._register_dependencies) instead of by
+    editing the config of the report, so that rendering has no side effects.
+
+    Each dependency is kept once however many nodes add it, and is placed
+    either in the head or, if it is not needed for the first paint of the
+    page, at the end of the body. External scripts can also be loaded with
+    defer or async.
+    '''
+
+    placements = ['head', 'body end']
+
+    def __init__(self):
+
+        self._placements = {}
+
+
+    def add(self, html, placement='head', loading=None):
+
+        if placement not in self.placements:
+            raise ValueError(f'placement should be one of {self.placements} but is {placement}')
+        if loading not in [None, 'defer', 'async']:
+            raise ValueError(f"loading should be None, 'defer' or 'async' but is {loading}")
+
+        if html.strip() == '':
+            return
+
+        if loading is not None:
+            html = _re.sub(r'<script(?=[^>]*\ssrc=)', f'<script {loading}', html)
+
+        # a dependency needed in the head is not moved to the end of the body
+        if self._placements.get(html) != 'head':
+            self._placements[html] = placement
+
+
+    def html(self, placement):
+
+        return ''.join(html for html, x in self._placements.items() if x == placement)
+
+
+class AssetReader():
+    '''
+    Reads the files that will be needed while rendering a report ahead of the
+    renderer and concurrently, see Report.to_html_async.
+
+    paths is the list of files in the order the renderer will ask for them.
+    They are read by prefetch (a coroutine run in the event loop) with at most
+    concurrency files being read or held in memory (read but not yet consumed)
+    at any time, so that the renderer, which runs in another thread, never
+    waits on the disk unless it gets ahead of the reads.
+
+    Files which the renderer does not end up asking for (for instance because
+    the html of an ancestor was cached) are dropped as soon as a later file is
+    asked for, and anything asked for but not in paths is read directly.
+    '''
+
+    def __init__(self, paths, concurrency):
+
+        if concurrency<1:
+            raise ValueError(f'concurrency should be at least 1 but is {concurrency}')
+
+        self._entries = [{'path':str(path), 'future':_futures.Future(),
+                          'scheduled':False, 'released':False}
+                         for path in paths]
+        self._concurrency = concurrency
+        self._next = 0
+        self._lock = _threading.Lock()
+        self._loop = None
+        self._semaphore = None
+
+
+    async def prefetch(self):
+
+        self._loop = _asyncio.get_running_loop()
+        self._semaphore = _asyncio.Semaphore(self._concurrency)
+        tasks = []
+
+        for entry in self._entries:
+
+            await self._semaphore.acquire()
+
+            with self._lock:
+                if entry['future'].cancelled():
+                    self._semaphore.release()
+                    continue
+                entry['scheduled'] = True
+
+            tasks.append(self._loop.create_task(self._read(entry)))
+
+        await _asyncio.gather(*tasks)
+
+
+    async def _read(self, entry):
+
+        try:
+            data = await self._loop.run_in_executor(None, _read_file, entry['path'])
+        except Exception as error:
+            result = (entry['future'].set_exception, error)
+        else:
+            result = (entry['future'].set_result, data)
+
+        with self._lock:
+            if not entry['future'].cancelled():
+                result[0](result[1])
+
+
+    def read(self, path):
+
+        path = str(path)
+
+        with self._lock:
+            for index in range(self._next, len(self._entries)):
+                if self._entries[index]['path'] == path:
+                    break
+            else:
+                index = None
+
+            if index is not None:
+                for skipped in self._entries[self._next:index]:
+                    self._discard(skipped)
+                self._next = index + 1
+
+        if index is None:
+            return _read_file(path)
+
+        entry = self._entries[index]
+
+        try:
+            return entry['future'].result()
+        finally:
+            entry['future'] = None
+            with self._lock:
+                self._release(entry)
+
+
+    def close(self):
+        '''
+        Drop every file that has not been asked for so that prefetch can
+        finish.
+        '''
+
+        with self._lock:
+            for entry in self._entries[self._next:]:
+                self._discard(entry)
+            self._next = len(self._entries)
+
+
+    def _discard(self, entry):
+
+        if not entry['future'].done():
+            entry['future'].cancel()
+        else:
+            # keep the future (cancelled or not) but not the contents
+            entry['future'] = _futures.Future()
+            entry['future'].cancel()
+
+        if entry['scheduled']:
+            self._release(entry)
+
+
+    def _release(self, entry):
+
+        if not entry['released'] and self._loop is not None:
+            entry['released'] = True
+            self._loop.call_soon_threadsafe(self._semaphore.release)
+
+
+class AssetStore():
+    '''
+    Directory into which the assets of a report are written, when it is
+    rendered with assets='sidecar' (see Report.to_html), under file names
+    derived from the hash of their contents. The html refers to them by
+    paths relative to the report, so the directory should be next to it.
+
+    Since the names only depend on the contents, assets used several times
+    (also across renders) are only written once. Files are written to a
+    temporary name and then renamed so that worker processes writing the same
+    asset do not interfere with each other.
+    '''
+
+    def __init__(self, directory):
+
+        self.directory = _os.path.abspath(str(directory))
+        self.url = _urlparse.quote(_os.path.basename(self.directory))
+
+
+    def store(self, data, suffix):
+        '''
+        Write data into the directory and return the url of the file.
+        '''
+
+        name, path = self._name(data, suffix)
+
+        if not _os.path.exists(path):
+            _os.makedirs(self.directory, exist_ok=True)
+            temp_path = f'{path}.{_os.getpid()}-{_threading.get_ident()}.tmp'
+
+            with open(temp_path, 'wb') as fp:
+                fp.write(data)
+
+            _os.replace(temp_path, path)
+
+        return f'{self.url}/{name}'
+
+
+    def link(self, source_path, data):
+        '''
+        Same as store for the file at source_path (whose contents are data),
+        but the file is hardlinked into the directory where possible instead of
+        being copied.
+        '''
+
+        suffix = _os.path.splitext(str(source_path))[1]
+        name, path = self._name(data, suffix)
+
+        if not _os.path.exists(path):
+            _os.makedirs(self.directory, exist_ok=True)
+
+            try:
+                _os.link(str(source_path), path)
+            except FileExistsError:
+                pass
+            except OSError:
+                return self.store(data, suffix)
+
+        return f'{self.url}/{name}'
+
+
+    def externalize_scripts(self, html):
+        '''
+        Move the contents of the inline scripts in html to files in the
+        directory and refer to them with src instead. Scripts run in the same
+        order, and scripts shared between fragments (such as the plotly.js
+        bundle embedded in every plot) are only written once.
+        '''
+
+        def externalize(match):
+
+            attributes, script = match.groups()
+
+            if 'src=' in attributes or script.strip() == '':
+                return match.group()
+
+            url = self.store(script.encode('utf-8'), '.js')
+
+            return f'<script{attributes} src="{url}"></script>'
+
+        return _re.sub(r'<script([^>]*)>(.*?)</script>', externalize, html, flags=_re.DOTALL)
+
+
+    def _name(self, data, suffix):
+
+        name = _hashlib.sha256(data).hexdigest()[:16] + suffix.lower()
+
+        return name, _os.path.join(self.directory, name)
+
+
+def sidecar_directory(output_path):
+    '''
+    The directory in which the assets of the report saved to output_path are
+    stored, i.e. <report>_assets next to it.
+    '''
+
+    output_path = _pathlib.Path(output_path)
+
+    return output_path.with_name(output_path.stem + '_assets')
+
+
+def _is_path(source):
+
+    return isinstance(source, (str, _pathlib.PurePath))
+
+
+def _read_file(path):
+
+    with open(str(path), 'rb') as fp:
+        return fp.read()
+
+
+def _init_worker():
+
+    # forked workers inherit the state of the random number generator, reseed
+    # so that randomly generated ids (see Plot) differ between workers
+    _rand.seed()
+
+
+def installed_plotlyjs_version():
+
+    import plotly.offline
+
+    return tuple(int(x) for x in plotly.offline.get_plotlyjs_version().split('.'))
+
+
+def _render_detached(node, ctx):
+    '''
+    Render a node sent to a worker process by RenderContext.start_pool, see
+    RenderContext._detached.
+    '''
+
+    return node._generate_html(ctx)
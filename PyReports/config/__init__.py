@@ -1 +1,6 @@
-from .config import *
\ No newline at end of file
+from .config import *
+from .config import __getattr__
+
+# config is loaded by __getattr__ when it is first used, the submodule of the
+# same name is not exposed in its place
+del config
@@ -6,10 +6,13 @@ Created on Tue Feb  1 12:45:30 2022
 @author: Sina Tureli
 """
 import configparser as _cp
+import collections as _collections
 import os as _os
 
 _CONFIG_PATH = _os.path.dirname(_os.path.realpath(__file__))
 _USE_DEFAULT = False
+# parsed config files and css files (see _cached), shared by all the reports
+_CACHE = {}
 
 def format_config_item(config_item):
     split_item = config_item.split('\n')
@@ -35,10 +38,15 @@ def user_config():
     _USE_DEFAULT = False
 
 def load_config(update_config_name='user'):
+    '''
+    The scripts and styles of the default config updated with those of the
+    config named update_config_name (unless default_config was called). The
+    config files are parsed once and cached until they are modified, each call
+    returns sections which are views of the cached ones: items set in them are
+    kept in the view and do not change the cache or other views.
+    '''
 
-    config = _cp.ConfigParser(interpolation=None)
-
-    config.read(f'{_CONFIG_PATH}/default.ini')
+    paths = [f'{_CONFIG_PATH}/default.ini']
 
     if not _USE_DEFAULT:
         if not _os.path.exists(f'{_CONFIG_PATH}/{update_config_name}.ini'):
@@ -46,7 +54,19 @@ def load_config(update_config_name='user'):
                              f'{_CONFIG_PATH}/{update_config_name}.ini '
                              'does not exist.')
 
-        config.read(f'{_CONFIG_PATH}/{update_config_name}.ini')
+        paths.append(f'{_CONFIG_PATH}/{update_config_name}.ini')
+
+    config_dict = _cached(paths, _parse_config)
+
+    return {section:_collections.ChainMap({}, items)
+            for section,items in config_dict.items()}
+
+def _parse_config(paths):
+
+    config = _cp.ConfigParser(interpolation=None)
+
+    for path in paths:
+        config.read(path)
 
     config_dict = {}
 
@@ -63,6 +83,45 @@ def load_config(update_config_name='user'):
 
     return config_dict
 
+def load_css(path):
+    '''
+    The css file at path indented to be put in the style element of a report,
+    cached until the file is modified.
+    '''
+
+    return _cached([path], _read_css)
+
+def _read_css(paths):
+
+    with open(paths[0], 'r') as fp:
+        css_lines = fp.readlines()
+
+    return '\n'.join(map(lambda x: f"    {x}", css_lines))
+
+def clear_cache():
+    '''
+    Forget the config and css files read so far.
+    '''
+
+    _CACHE.clear()
+
+def _cached(paths, load):
+    '''
+    load(paths) cached by the paths and the modification times of their files
+    so that the files are read again only after they change. Only the latest
+    result for the same paths is kept.
+    '''
+
+    key = tuple(paths)
+    mtimes = tuple(_os.stat(path).st_mtime_ns for path in paths)
+    cached = _CACHE.get(key)
+
+    if cached is None or cached[0] != mtimes:
+        cached = (mtimes, load(paths))
+        _CACHE[key] = cached
+
+    return cached[1]
+
 def save_config(config_dict, path):
 
     if path[-4:] != '.ini':
@@ -81,4 +140,18 @@ def save_config(config_dict, path):
        config.write(configfile)
 
 
-config = load_config()
+def __getattr__(name):
+    '''
+    config is only loaded from the config files when it is first used, and
+    kept from then on like any module level variable.
+    '''
+
+    global config
+
+    if name == 'config':
+        if 'config' not in globals():
+            config = load_config()
+
+        return config
+
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -9,10 +9,14 @@ Created on Mon Jan 17 13:28:59 2022
 
 import re as _re
 import os as _os
+import io as _pyio
+import asyncio as _asyncio
+import concurrent.futures as _futures
 
-from bs4 import BeautifulSoup as _bs
 from . import config
 from . import objects
+from . import _io
+from . import _render
 from pathlib import Path, PosixPath
 
 _NoneType = type(None)
@@ -26,6 +30,8 @@ class _Container(objects._Context, objects._Node):
     derive from
     '''
 
+    __slots__ = ()
+
     def __init__(self, parent=None):
 
         objects._Context.__init__(self)
@@ -43,7 +49,7 @@ class _Container(objects._Context, objects._Node):
 
         '''
 
-        return self._has('_tabs')
+        return self._has('tab')
 
 
     @property
@@ -57,7 +63,7 @@ class _Container(objects._Context, objects._Node):
 
         '''
 
-        return self._has('_grids')
+        return self._has('grid')
 
 
     @property
@@ -71,7 +77,7 @@ class _Container(objects._Context, objects._Node):
 
         '''
 
-        return self._has('_codes')
+        return self._has('code')
 
 
     @property
@@ -85,7 +91,37 @@ class _Container(objects._Context, objects._Node):
 
         '''
 
-        return self._has('_tables')
+        return self._has('table')
+
+
+    @property
+    def _has_deferred(self):
+        '''
+
+        Returns
+        -------
+        bool
+            Whether or not any of its subcontainers has tabs or folds whose
+            content is deferred
+
+        '''
+
+        return any(item._defer for item in self._tabs + self._folds)
+
+
+    @property
+    def _has_virtual_table(self):
+        '''
+
+        Returns
+        -------
+        bool
+            Whether or not any of its subcontainers has tables rendered in
+            virtual mode
+
+        '''
+
+        return any(table._mode == 'virtual' for table in self._tables)
 
 
     @property
@@ -99,7 +135,7 @@ class _Container(objects._Context, objects._Node):
 
         '''
 
-        return self._has('_folds')
+        return self._has('fold')
 
 
     @property
@@ -182,7 +218,25 @@ class _Container(objects._Context, objects._Node):
         return codes
 
 
-    def _has(self, item):
+    def _generate_html(self, ctx=None):
+
+        '''
+
+        Returns
+        -------
+        html : str
+            The html code of this container, collected from the fragments
+            streamed by _write_html.
+
+        '''
+
+        fragments = []
+        self._write_html(fragments.append, ctx)
+
+        return ''.join(fragments)
+
+
+    def _has(self, item_name):
 
         '''
 
@@ -192,7 +246,8 @@ class _Container(objects._Context, objects._Node):
             Whether or not any of its subcontainers has the given item in them
 
         '''
-        return len(self.__getattribute__(item))>0
+
+        return self._count(self._item_class(item_name))>0
 
 
     def _items(self, item_name):
@@ -205,6 +260,13 @@ class _Container(objects._Context, objects._Node):
             list of given items in this container
 
         '''
+
+        return list(self.iter_descendants(self._item_class(item_name)))
+
+
+    @staticmethod
+    def _item_class(item_name):
+
         if item_name == 'code':
             item_class = objects.Code
         elif item_name == 'table':
@@ -215,12 +277,7 @@ class _Container(objects._Context, objects._Node):
             class_name = item_name.capitalize()
             item_class = globals()[class_name]
 
-        items = []
-        for descendant in self._descendants():
-            if isinstance(descendant, item_class):
-                items.append(descendant)
-
-        return items
+        return item_class
 
 
 class Report(_Container):
@@ -232,6 +289,11 @@ class Report(_Container):
     report object as the root. The tree structure is for simple book keeping
     and formatting the html code for the report so that it is easy on the eyes.
 
+    The report keeps its sections but they only keep a weak reference to the
+    report, so the report should be kept (in a variable or as a context) for
+    as long as its sections are used. Once it is garbage collected, its
+    sections no longer have a parent.
+
     Attributes and properties
     ----------
     title()
@@ -239,6 +301,7 @@ class Report(_Container):
     section()
     sections
     to_html()
+    to_html_async()
     _has_tex
     _title_html
     _add_styles()
@@ -251,6 +314,10 @@ class Report(_Container):
              see user.ini for changing the default values
 
     '''
+
+    __slots__ = ('_title', '_pretext', '_meta', '_update_config_name', '_CONFIG',
+                 '_title_style')
+
     def __init__(self, title: str, title_style: str=None, meta: str=None,
                  pretext: str=None, update_config_name: str='user'):
         '''
@@ -369,15 +436,71 @@ class Report(_Container):
         return [x for x in self._children if isinstance(x,Section)]
 
 
-    def to_html(self, output_path: str|PosixPath, return_html: bool=False):
+    def batch(self):
+        '''
+        For building deeply nested reports quickly. Nodes attached to the
+        report inside
+
+        with report.batch():
+            ...
+
+        are attached without checking their parents or updating the
+        bookkeeping of their ancestors one by one. Instead the report is
+        brought up to date in one pass when the batch ends, after which the
+        parents of the new nodes are checked (an invalid parent raises a
+        ValueError then). The report can not be rendered or summarized inside
+        a batch, other reports are not affected by it.
+
+        The bookkeeping that is skipped grows with the depth of the nodes, so
+        this pays off for deep reports. The nodes themselves are still created
+        (and their inputs checked) one by one, which is most of the time it
+        takes to build a wide and shallow report.
+
+        Returns
+        -------
+        context manager
+            which returns the report when entered
+
+        '''
+
+        return objects._Batch(self)
+
+
+    def to_html(self, output_path, return_html: bool=False, cache: bool=False,
+                workers: int=None, dedup_assets: bool=False, assets: str='embed'):
         '''
 
         Parameters
         ----------
-        output_path : str
-            path to save the report
+        output_path : str, PosixPath or file-like
+            path to save the report or a file-like object (text or binary
+            file, StringIO, BytesIO, gzip stream, sys.stdout, socket etc.) into
+            which the html is streamed. Can only be None if return_html is True.
         return_html : bool, optional
             whether or not to return the generated html as a string. The default is False.
+        cache : bool, optional
+            whether or not to keep the rendered html of each object in memory
+            so that subsequent calls to to_html only re-render the parts of the
+            report that changed (useful when the report is rendered repeatedly
+            while being built, such as in notebooks). See clear_render_cache.
+            The default is False.
+        workers : int, optional
+            number of worker processes used to render the objects that are
+            expensive to render (images, plots, maps and tables). The fragments
+            are written in document order as they become available. The default
+            is None which renders everything in this process.
+        dedup_assets : bool, optional
+            whether or not to embed each image or plot which appears several
+            times in the report (the same file, or the same figure object) only
+            once. The other occurrences refer to it and are filled in by a
+            script when the page is loaded. The default is False.
+        assets : str, optional
+            either 'embed' to embed images into the html (as a single file) or
+            'sidecar' to write images, the scripts of plots and pdfs (as well
+            as non embedded images) into a <report>_assets directory next to
+            the report under names derived from their contents, to which the
+            html refers. 'sidecar' requires output_path to be a path or a
+            file opened from a path. The default is 'embed'.
 
         Returns
         -------
@@ -386,13 +509,220 @@ class Report(_Container):
 
         '''
 
-        self._check_types(['output_path','return_html'],
-                          [output_path, return_html],
-                          [(str, PosixPath), bool],'to_html')
+        self._check_types(['return_html', 'cache', 'workers', 'dedup_assets', 'assets'],
+                          [return_html, cache, workers, dedup_assets, assets],
+                          [bool, bool, (int, _NoneType), bool, str], 'to_html')
+
+        ctx = self._report_context(output_path, return_html, cache, dedup_assets, assets)
+
+        return self._to_html(output_path, return_html, ctx, workers)
+
+
+    async def to_html_async(self, output_path, return_html: bool=False,
+                            cache: bool=False, workers: int=None,
+                            concurrency: int=16, dedup_assets: bool=False,
+                            assets: str='embed'):
+        '''
+
+        Asynchronous version of to_html which produces the same html. The
+        files the report depends on (images, plots and maps given as paths,
+        the code style css) are read ahead of time and concurrently while the
+        report is rendered in a separate thread, so the event loop is never
+        blocked by rendering or by disk I/O.
+
+        Parameters
+        ----------
+        output_path : str, PosixPath or file-like
+            see to_html. Note that a file-like sink is written to from the
+            rendering thread.
+        return_html : bool, optional
+            see to_html. The default is False.
+        cache : bool, optional
+            see to_html. The default is False.
+        workers : int, optional
+            see to_html. The default is None.
+        concurrency : int, optional
+            maximum number of files which are being read or have been read but
+            not yet rendered at any given time. The default is 16.
+        dedup_assets : bool, optional
+            see to_html. The default is False.
+        assets : str, optional
+            see to_html. The default is 'embed'.
+
+        Returns
+        -------
+        html : str
+            if return_html is True, this is the returned html string.
+
+        '''
+
+        self._check_types(['return_html', 'cache', 'workers', 'concurrency',
+                           'dedup_assets', 'assets'],
+                          [return_html, cache, workers, concurrency, dedup_assets,
+                           assets],
+                          [bool, bool, (int, _NoneType), int, bool, str], 'to_html_async')
+
+        ctx = self._report_context(output_path, return_html, cache, dedup_assets, assets)
+        ctx.reader = _render.AssetReader(self._asset_paths_in_order(ctx, workers),
+                                         concurrency)
+
+        loop = _asyncio.get_running_loop()
+        prefetch = loop.create_task(ctx.reader.prefetch())
+
+        try:
+            return await loop.run_in_executor(None, self._to_html, output_path,
+                                              return_html, ctx, workers)
+        finally:
+            ctx.reader.close()
+            await prefetch
+
+
+    def _report_context(self, output_path, return_html, cache, dedup_assets, assets):
+
+        objects._Batch.check_inactive(self, 'render a report')
+
+        if output_path is None and not return_html:
+            raise ValueError('output_path can only be None if return_html is True')
+
+        if assets not in ['embed', 'sidecar']:
+            raise ValueError(f"assets should be 'embed' or 'sidecar' but is {assets}")
+
+        asset_store = None
+
+        if assets == 'sidecar':
+            # files opened from a path know their path, other streams (such
+            # as sys.stdout) may have a name which is not a path
+            path = output_path if isinstance(output_path, (str, PosixPath)) \
+                else getattr(output_path, 'name', None)
+
+            if (not isinstance(path, (str, PosixPath)) or
+                (path is not output_path and not _os.path.isabs(path) and
+                 not _os.path.exists(path))):
+                raise ValueError("assets can only be 'sidecar' if output_path is a path "
+                                 "or a file opened from a path")
+
+            asset_store = _render.AssetStore(_render.sidecar_directory(path))
+
+        return _render.RenderContext(self, cache=cache, dedup_assets=dedup_assets,
+                                     assets=asset_store)
+
+
+    def _to_html(self, output_path, return_html, ctx, workers):
+
+        if return_html:
+            html_buffer = _pyio.StringIO()
+            self._render(_io.html_writer(html_buffer), ctx, workers)
+            html = html_buffer.getvalue()
+
+            if isinstance(output_path, (str, PosixPath)):
+                with Path(output_path).open('w') as file:
+                    file.write(html)
+            elif output_path is not None:
+                _io.html_writer(output_path)(html)
+
+            return html
+
+        if isinstance(output_path, (str, PosixPath)):
+            with Path(output_path).open('w') as file:
+                self._render(_io.html_writer(file), ctx, workers)
+        else:
+            self._render(_io.html_writer(output_path), ctx, workers)
+
+
+    def _asset_paths_in_order(self, ctx, workers):
+        '''
+        Files read while rendering the report with ctx, in the order they
+        are read (see _render): first those read while registering head
+        dependencies and then those read by the nodes rendered in this
+        process. The code style css is read through the cache of the config
+        module.
+        '''
+
+        pooled = workers is not None and workers>=2
+
+        paths = [path for node in self.iter_descendants() if not ctx.is_reference(node)
+                 for path in node._dependency_paths()]
+
+        paths += [path for node in self.iter_descendants()
+                  if not ctx.is_reference(node) and not ctx._is_cached(node)
+                  and not (pooled and node._render_in_pool)
+                  for path in node._asset_paths(ctx)]
+
+        return paths
+
+
+    def write_html(self, sink, cache: bool=False, workers: int=None,
+                   dedup_assets: bool=False, assets: str='embed'):
+        '''
+
+        Stream the html of the report into sink. The head is assembled up
+        front (after every node has registered the scripts and styles it needs)
+        and then each node writes its fragment of the body directly into the
+        sink, so only the largest single fragment (typically an embedded image
+        or plot) has to be held in memory at any time.
+
+        Parameters
+        ----------
+        sink : str, PosixPath or file-like
+            path, text or binary file-like object or socket, see to_html.
+        cache : bool, optional
+            whether or not to cache rendered fragments, see to_html.
+        workers : int, optional
+            number of worker processes to render with, see to_html.
+        dedup_assets : bool, optional
+            whether or not to embed repeated assets once, see to_html.
+        assets : str, optional
+            'embed' or 'sidecar', see to_html. 'sidecar' requires sink to be
+            a path or a file opened from a path. The default is 'embed'.
+
+        Returns
+        -------
+        None.
+
+        '''
+
+        self.to_html(sink, cache=cache, workers=workers, dedup_assets=dedup_assets,
+                     assets=assets)
+
+
+    def _render(self, write, ctx, workers):
+
+        for node in self.iter_descendants():
+            # nodes referring to a shared asset need the same head as the
+            # node embedding it
+            if not ctx.is_reference(node):
+                node._register_dependencies(ctx)
+
+        ctx.choose_plotlyjs()
 
         head_html = '<!-- Report generated by PyReports (author: Sina Tureli). -->\n\n'
         head_html += '<!DOCTYPE html>\n<html>\n'
         head_html += '<head>\n'
+        head_html += '\n' + self._add_scripts(ctx)
+        head_html += '\n'.join(self._add_styles(ctx))
+        head_html += '</head>\n'
+
+        write(head_html)
+
+        if workers is None or workers<2:
+            self._write_html(write, ctx)
+        else:
+            pool_nodes = [node for node in self.iter_descendants() if node._render_in_pool]
+
+            with _futures.ProcessPoolExecutor(workers, initializer=_render._init_worker) as executor:
+                ctx.start_pool(executor, pool_nodes, window=4*workers)
+
+                try:
+                    self._write_html(write, ctx)
+                finally:
+                    ctx.stop_pool()
+
+        for node in self.iter_descendants():
+            objects._setattr(node, '_dirty', False)
+
+
+    def _html_parts(self, ctx):
+
         body_html = ''
 
         if self._pretext != '':
@@ -406,30 +736,19 @@ class Report(_Container):
         body_html += self._title_html
 
         if len(self.sections)>0:
-            summary = str(self.summary(link_to_sections=True))
+            summary = _io.to_ascii(self, detailed=False, formatting='none',
+                                   link_to_sections=True, ctx=ctx)
             summary = summary.replace('SUBSUBSECTION (','').replace('SUBSECTION (','').\
               replace('SECTION (','').replace(')\n','\n')
             summary = '\n'.join(summary.split('\n')[1:])
             body_html += '<pre>\n' + summary + '</pre>\n'
 
-        for ind,child in enumerate(self._children):
-
-            body_html += child._generate_html()
-
-        body_html += '</body>\n\n<!-- END REPORT -->\n</html>'
+        yield body_html
 
-        head_html += '\n' + self._add_scripts()
+        yield from self._children
 
-        head_html += '\n'.join(self._add_styles())
-
-        head_html += '</head>\n'
-
-        html = head_html + body_html
-        with Path(output_path).open('w') as file:
-            file.writelines(html)
-
-        if return_html:
-            return html
+        yield ctx.dependencies.html('body end')
+        yield '</body>\n\n<!-- END REPORT -->\n</html>'
 
 
     @property
@@ -453,7 +772,7 @@ class Report(_Container):
 
 
 
-    def _add_styles(self):
+    def _add_styles(self, ctx=None):
         '''
         Generate relevant styles for the <head> of the html, called during report
         rendering.
@@ -468,9 +787,9 @@ class Report(_Container):
         p_style = CONFIG['STYLES']['P STYLE']
         img_style = CONFIG['STYLES']['IMG STYLE']
         user_styles = CONFIG['STYLES']['USER STYLES']
-        code_style = CONFIG['STYLES']['CODE STYLE'].lstrip(' ')
         fold_styles = CONFIG['STYLES']['FOLD STYLES']
         table_styles = CONFIG['STYLES']['TABLE STYLES']
+        virtual_table_styles = CONFIG['STYLES']['VIRTUAL TABLE STYLES']
         #  add head with styles
         style_html = ['\n    <style>']
 
@@ -488,48 +807,68 @@ class Report(_Container):
         if self._has_table:
             style_html += [table_styles]
 
+        if self._has_virtual_table:
+            style_html += [virtual_table_styles]
+
 
         if self._has_code:
-          code_style_css_path = _os.path.join(css_dir,f'{code_style}.css')
+          style_html.append(config.load_css(self._code_style_css_path()))
 
-          with open(code_style_css_path, "r") as fp:
-            code_style_css = '\n'.join(map(lambda x: f"    {x}", fp.readlines()))
+        style_html += ['    </style>\n']
 
+        return style_html
 
-          style_html.append(code_style_css)
 
-        style_html += ['    </style>\n']
+    def _code_style_css_path(self):
 
-        return style_html
+        code_style = self._CONFIG['STYLES']['CODE STYLE'].lstrip(' ')
 
+        return _os.path.join(css_dir,f'{code_style}.css')
 
-    def _add_scripts(self):
+
+    def _register_dependencies(self, ctx):
         '''
-        Generate relevant scripts for the <head> of the html, called during report
-        rendering.
+        Register the relevant scripts from the config. Those which are only
+        needed once the page is shown (tabs, folds, sortable tables etc.) are
+        placed at the end of the body.
         '''
 
-        scripts_html = f'    {self._meta}'
         CONFIG = self._CONFIG
 
-        if self._has_tab:
-            scripts_html +=  CONFIG['SCRIPTS']['TAB SCRIPT']
-
         if self._has_tex:
-            scripts_html += CONFIG['SCRIPTS']['TEX SCRIPT']
+            ctx.dependencies.add(CONFIG['SCRIPTS']['TEX SCRIPT'])
 
-        if self._has_code:
-            scripts_html += CONFIG['SCRIPTS']['CODE SCRIPT']
+        if any(code._highlight == 'prettify' for code in self._codes):
+            ctx.dependencies.add(CONFIG['SCRIPTS']['CODE SCRIPT'], loading='defer')
+
+        ctx.dependencies.add(CONFIG['SCRIPTS']['USER SCRIPTS'])
+
+        if self._has_tab:
+            ctx.dependencies.add(CONFIG['SCRIPTS']['TAB SCRIPT'], 'body end')
 
         if self._has_fold:
-            scripts_html += CONFIG['SCRIPTS']['FOLD SCRIPT']
+            ctx.dependencies.add(CONFIG['SCRIPTS']['FOLD SCRIPT'], 'body end')
+
+        if self._has_deferred:
+            ctx.dependencies.add(CONFIG['SCRIPTS']['DEFERRED SCRIPT'], 'body end')
 
         if self._has_table:
-            scripts_html += CONFIG['SCRIPTS']['TABLE SCRIPT']
+            ctx.dependencies.add(CONFIG['SCRIPTS']['TABLE SCRIPT'], 'body end')
 
-        scripts_html += CONFIG['SCRIPTS']['USER SCRIPTS']
+        if self._has_virtual_table:
+            ctx.dependencies.add(CONFIG['SCRIPTS']['VIRTUAL TABLE SCRIPT'], 'body end')
+
+        if len(ctx.shared_assets)>0:
+            ctx.dependencies.add(CONFIG['SCRIPTS']['ASSET SCRIPT'], 'body end')
+
+
+    def _add_scripts(self, ctx):
+        '''
+        Generate relevant scripts for the <head> of the html, called during report
+        rendering after the dependencies of all the nodes are registered.
+        '''
 
-        return scripts_html
+        return f'    {self._meta}' + ctx.dependencies.html('head')
 
 
 class Section(_Container):
@@ -543,7 +882,7 @@ class Section(_Container):
     _is_subsection
     _section_no
     _section_no_str
-    _title_html
+    _heading_html
     _nitems
     _generate_html()
 
@@ -554,6 +893,8 @@ class Section(_Container):
 
     '''
 
+    __slots__ = ('_has_tex', '_title', '_title_style')
+
     def __init__(self, title, title_style = None, has_tex=False, parent=None):
         '''
         Parameters
@@ -584,6 +925,11 @@ class Section(_Container):
             what works under the hood when second method is used (+ some context
             management).
 
+            The section only keeps a weak reference to its parent, so
+            Section('section title', Report('report title')) loses its
+            parent as soon as the report, which nothing else keeps, is
+            garbage collected.
+
 
         Returns
         -------
@@ -678,7 +1024,7 @@ class Section(_Container):
         if self._parent is None:
             section_no = 1
         else:
-            section_no = self._parent.sections.index(self) + 1
+            section_no = self._parent._children.index(self, Section) + 1
 
         return section_no
 
@@ -708,20 +1054,17 @@ class Section(_Container):
         return section_no_str
 
 
-    @property
-    def _title_html(self):
+    def _heading_html(self, depth):
         '''
 
         Returns
         -------
         title_html : str
-            The title str for the section used in the html with some commentes
-            and the title_style included.
+            The title str for the section at the given depth of the report
+            with the title_style included.
 
         '''
 
-        depth = self._depth
-
         if depth>5:
             htag = 'h6'
         else:
@@ -755,20 +1098,19 @@ class Section(_Container):
         return nitems
 
 
-    def _generate_html(self):
+    def _html_parts(self, ctx):
         '''
 
-        Returns
-        -------
-        section_html : str
-            The html code that represents the contents of this section.
-            Called when the parent containing this section is generating
-            its html code (either the parent Section's _generate_html()
-                           or the parent Report' to_html() methods)
+        Gives the html code that represents the contents of this section in
+        parts (see _Node._write_html), its children are written in between
+        the start and the end of the section.
 
         '''
 
-        title_html = self._title_html
+        depth = ctx.depth[self]
+        section_no_str = ctx.section_no_str[self]
+
+        title_html = self._heading_html(depth)
 
         if not self._is_subsection:
             section_type = 'SECTION'
@@ -779,31 +1121,28 @@ class Section(_Container):
 
         section_html = ''
 
-        depth = self._depth
-
         hr_index = depth
         if hr_index>3: hr_index=3
 
-        section_html += '\n' + '    '*depth + f'<!-- START {section_type} {self._section_no_str} -->\n'
-        section_html += '\n' + '    '*depth + f'<div id="S{self._section_no_str}">'
+        section_html += '\n' + '    '*depth + f'<!-- START {section_type} {section_no_str} -->\n'
+        section_html += '\n' + '    '*depth + f'<div id="S{section_no_str}">'
         section_html += '    '*depth + f'<section style="margin-left:{20*depth}px; margin-bottom:10px; border-left:{border}; padding-left:10px">\n'
         section_html += '    '*depth + f'{title_html}\n'
 
+        yield section_html
 
-        for ind,child in enumerate(self._children):
-
-            html =  child._generate_html()
+        for child in self._children:
 
             if isinstance(child, Section) and child._has_tex:
-                html = html.replace('\n','<br>\n')
-
-            section_html += html
+                yield child, lambda html: html.replace('\n','<br>\n')
+            else:
+                yield child
 
-        section_html += '\n' + '    '*depth + '<div>'
+        section_html = '\n' + '    '*depth + '<div>'
         section_html += '    '*depth + '</section>\n'
-        section_html += '\n'+'    '*depth + f'<!-- END {section_type} {str(self._section_no_str)} -->\n'
+        section_html += '\n'+'    '*depth + f'<!-- END {section_type} {section_no_str} -->\n'
 
-        return section_html
+        yield section_html
 
 
 class Tab(_Container):
@@ -813,10 +1152,16 @@ class Tab(_Container):
         with Tab(['Tab1','Tab2']):
             [Image(x) for x in ['path1.png','path2.png']]
 
+    If defer is True, the contents of the tabs which are not open by default are
+    put in templates and only added to the page the first time they are opened.
+
     '''
 
+    __slots__ = ('_end', '_tab_style', '_button_styles', '_content_styles',
+                 '_tab_titles', '_defer')
+
     def __init__(self, tab_titles, tab_style=None, button_styles=None, content_styles=None,
-                 end='<br><br>', parent=None):
+                 end='<br><br>', parent=None, defer=False):
 
         _Container.__init__(self, parent)
 
@@ -825,6 +1170,7 @@ class Tab(_Container):
         self._button_styles = button_styles
         self._content_styles = content_styles
         self._tab_titles = tab_titles
+        self._defer = defer
 
 
     def add_object(self, obj):
@@ -841,41 +1187,6 @@ class Tab(_Container):
         return len(self._children)
 
 
-    @property
-    def _root_section(self):
-
-        parent = self._parent
-
-        while isinstance(parent._parent, Section) or not isinstance(parent, Section):
-            parent = parent._parent
-
-        return parent
-
-
-    @property
-    def _tab_item_ids(self):
-
-        report_tabs = self._root()._tabs
-        try:
-          I = report_tabs.index(self)
-        except:
-          breakpoint()
-        ntabs = sum([len(x._children) for x in report_tabs[:I]])
-
-        return [ntabs + i for i in range(len(self._children))]
-
-
-    @property
-    def _tab_name(self):
-        # class ids are required for open all and close buttons
-        # each tab that is given a class name so that the script
-        # which opens and closes tabs can supplied this class and
-        # closes or opens only items from the tab which has the given
-        # class name
-
-        return f'TAB-{self._root_section._section_no_str}-{self._root_section._tabs.index(self)}'
-
-
     @property
     def _styles(self):
 
@@ -898,7 +1209,7 @@ class Tab(_Container):
         return tab_style, button_styles
 
 
-    def _generate_html(self):
+    def _html_parts(self, ctx):
 
         if len(self._tab_titles) != self._nitems:
             raise ValueError(f'Number of tab titles {len(self._tab_titles)} does not match number of items {self._nitems} for {repr(self)}')
@@ -906,10 +1217,10 @@ class Tab(_Container):
         tab_style, button_styles = self._styles
 
         tab_html = ''
-        indent = '    '*(self._parent._depth + 1)
+        indent = '    '*(ctx.depth[self._parent] + 1)
 
-        item_ids = self._tab_item_ids
-        tab_name = self._tab_name
+        item_ids = ctx.tab_item_ids[self]
+        tab_name = ctx.tab_name[self]
 
         tab_html += '\n' + indent + f'<!-- START {tab_name} -->\n'
 
@@ -940,14 +1251,22 @@ class Tab(_Container):
 
             tab_html += indent + f'<div id="{item_ids[i]}" {display_style} class="tabcontent" name="{tab_name}">\n'
             tab_html += '    ' + indent + '<span onclick="this.parentElement.style.display=\'none\'" class="topright">x</span>\n'
-            tab_html += self._children[i]._generate_html()
 
+            deferred = self._defer and i>0
+
+            if deferred:
+                tab_html += '    ' + indent + '<template data-deferred>\n'
+
+            yield tab_html
+            yield self._children[i]
+
+            tab_html = '    ' + indent + '</template>\n' if deferred else ''
             tab_html += indent + '</div>\n'
 
         tab_html += indent + f'{self._end}' + '\n'
         tab_html += indent + f'<!-- END {tab_name} -->\n'
 
-        return tab_html
+        yield tab_html
 
 
 class Fold(_Container):
@@ -957,10 +1276,16 @@ class Fold(_Container):
         with Fold():
             Txt('Some text')
 
+    If defer is True, the content is put in a template and only added to the
+    page the first time the fold is opened.
+
     '''
 
+    __slots__ = ('_end', '_collapsible_style', '_button_style', '_content_style',
+                 '_defer')
+
     def __init__(self, collapsible_style=None, button_style=None, content_style=None,
-                 end='<br><br>', parent=None):
+                 end='<br><br>', parent=None, defer=False):
 
         _Container.__init__(self, parent)
 
@@ -968,6 +1293,7 @@ class Fold(_Container):
         self._collapsible_style = collapsible_style
         self._button_style = button_style
         self._content_style = content_style
+        self._defer = defer
 
 
     def add_object(self, obj):
@@ -978,17 +1304,6 @@ class Fold(_Container):
             obj._parent = self
 
 
-    @property
-    def _root_section(self):
-
-        parent = self._parent
-
-        while isinstance(parent._parent, Section):
-            parent = parent._parent
-
-        return parent
-
-
     @property
     def _styles(self):
 
@@ -1009,19 +1324,14 @@ class Fold(_Container):
         return collapsible_style, button_style
 
 
-    @property
-    def _fold_name(self):
-        return f'FOLD-{self._root_section._section_no_str}-{self._root_section._folds.index(self)}'
-
-
-    def _generate_html(self):
+    def _html_parts(self, ctx):
 
         tab_style, button_style = self._styles
 
         fold_html = ''
-        indent = '    '*(self._parent._depth + 1)
+        indent = '    '*(ctx.depth[self._parent] + 1)
 
-        fold_name = self._fold_name
+        fold_name = ctx.fold_name[self]
 
         fold_html += '\n' + indent + f'<!-- START {fold_name} -->\n'
 
@@ -1029,14 +1339,20 @@ class Fold(_Container):
 
         fold_html += '    '*2 + indent + '<div class="foldcontent">\n'
 
+        if self._defer:
+            fold_html += '    '*3 + indent + '<template data-deferred>\n'
+
+        yield fold_html
+
         for i in range(len(self._children)):
-            fold_html += self._children[i]._generate_html()
+            yield self._children[i]
 
+        fold_html = '    '*3 + indent + '</template>\n' if self._defer else ''
         fold_html += '    '*2 + indent + f'</div>{self._end}\n'
 
         fold_html += indent + f'<!-- END {fold_name} -->\n'
 
-        return fold_html
+        yield fold_html
 
 
 class Grid(objects._Context,objects._Node):
@@ -1046,6 +1362,9 @@ class Grid(objects._Context,objects._Node):
     PlotlyGrid, MapGrid derive from this.
     '''
 
+    __slots__ = ('_end', '_nrows', '_ncols', '_grid_style', '_grid_item_styles',
+                 '_item_titles', '_fontsize', '_fontweight')
+
     def __init__(self, ncols, nrows=1, item_titles:list=None,
                  grid_style:str=None, grid_item_styles:list=None, end='<br><br>',
                  parent=None, fontsize=16, fontweight="bold"):
@@ -1084,11 +1403,13 @@ class Grid(objects._Context,objects._Node):
         self._fontsize = fontsize
         self._fontweight = fontweight
 
-    def _generate_html(self):
+    def _generate_html(self, ctx=None):
+
+        ctx = self._render_context(ctx)
 
         cols = 'auto '*self._ncols
         rows = 'auto '*self._nrows
-        indent = '    '*(self._parent._depth + 1)
+        indent = '    '*(ctx.depth[self._parent] + 1)
         grid_style = self._grid_style
         fontstyle =  f"<text style=\"font-size:{self._fontsize}px; font-weight:{self._fontweight};\">"
 
@@ -1104,15 +1425,12 @@ class Grid(objects._Context,objects._Node):
         html += indent + f'<div class="grid-container" style="grid-template-columns: {cols}; grid-template-rows: {rows}; {grid_style}">\n'
 
         for ind_child,child in enumerate(self._children):
-            child_html_str = child._generate_html()
+            child_html_str = ctx.fragment(child)
             child_html_str = _re.sub('(\/n)*$', '', child_html_str).strip('\n')
             child_style = self._grid_item_styles[ind_child]
 
-            if isinstance(child, objects.Text):
-                soup = _bs(child_html_str, 'html.parser')
-                text = _bs.get_text(soup).strip('\n').strip(' ')
-                if len(text)==0:
-                    child_style += 'background-color: inherit;'
+            if isinstance(child, objects.Text) and child._is_empty(child_html_str):
+                child_style += 'background-color: inherit;'
 
             if self._item_titles is not None:
                 child_html_str = fontstyle + self._item_titles[ind_child] + '</text><br>' + child_html_str
@@ -12,21 +12,26 @@ by the end user.
 
 """
 
-import matplotlib as _mpl
 import base64 as _b64
 import random as _rand
 import string as _str
 import re as _re
-import plotly as _plotly
-import PIL as _PIL
 import os as _os
 import ntpath as _ntp
+import json as _json
+import io as _pyio
+import weakref as _weakref
+import types as _types
 
 import PyReports as pr
 from . import _internal
+from . import _render
 from pathlib import PosixPath
 
 _NoneType = type(None)
+_setattr = object.__setattr__ # sets attributes of nodes without invalidating them
+_OWN_TYPE_COUNTS = {} # shared by the nodes of each type without children
+_NO_RENDER_CACHE = _types.MappingProxyType({}) # of the nodes which cache nothing
 cdir = _os.path.dirname(__file__)
 css_dir = _os.path.join(cdir,'css')
 
@@ -41,6 +46,8 @@ class _Context():
     for purposes of report generation so that is removed.
     """
 
+    __slots__ = ()
+
     _contexts = {'stack':[]}
     _loading_from_json = False
 
@@ -74,6 +81,286 @@ class _Context():
 
 
 
+class _Children():
+    '''
+    The children of a node in order. They are kept in a dict keyed by the
+    nodes themselves so that checking whether a node is a child, appending a
+    child and removing one are O(1). The list of the children and the
+    positions of the children (of each type) are computed the first time they
+    are needed after a change.
+
+    Nodes without children share _NO_CHILDREN and get their own _Children
+    when their first child is added (see _Node._add_child).
+    '''
+
+    __slots__ = ('_nodes', '_list', '_positions')
+
+    def __init__(self, children=()):
+
+        self._nodes = dict.fromkeys(children)
+        self._list = None
+        self._positions = None
+
+
+    def append(self, child):
+
+        self._nodes[child] = None
+        self._changed()
+
+
+    def remove(self, child):
+
+        try:
+            del self._nodes[child]
+        except KeyError:
+            raise ValueError(f'{child} is not a child.')
+
+        self._changed()
+
+
+    def index(self, child, item_class=None):
+        '''
+        Position of child among the children, or among those of type
+        item_class if it is given.
+        '''
+
+        if self._positions is None:
+            self._positions = {}
+
+        positions = self._positions.get(item_class)
+
+        if positions is None:
+            children = [x for x in self._as_list()
+                        if item_class is None or isinstance(x, item_class)]
+            positions = {x:ind for ind,x in enumerate(children)}
+            self._positions[item_class] = positions
+
+        try:
+            return positions[child]
+        except KeyError:
+            raise ValueError(f'{child} is not a child.')
+
+
+    def _changed(self):
+
+        self._list = None
+        self._positions = None
+
+
+    def _as_list(self):
+
+        if self._list is None:
+            self._list = list(self._nodes)
+
+        return self._list
+
+
+    def __iter__(self):
+
+        # iterates over a snapshot so children can be removed while iterating
+        return iter(self._as_list())
+
+
+    def __reversed__(self):
+
+        return reversed(self._as_list())
+
+
+    def __getitem__(self, index):
+
+        return self._as_list()[index]
+
+
+    def __len__(self):
+
+        return len(self._nodes)
+
+
+    def __contains__(self, child):
+
+        return child in self._nodes
+
+
+    def __repr__(self):
+
+        return repr(self._as_list())
+
+
+_NO_CHILDREN = _Children()
+
+
+class _Batch():
+    '''
+    Returned by Report.batch. While a batch of a report is active, nodes are
+    attached to the nodes of that report without checking the parent child
+    relations and without updating the type counts and the render caches of
+    their ancestors. When the (outermost) batch ends, the type counts of the
+    trees that changed are rebuilt in one pass over each tree and the parents
+    that changed are invalidated, then the relations of the nodes attached
+    during the batch are checked.
+
+    A batch only concerns the tree of its report, other reports are built
+    (and can be rendered) as usual meanwhile.
+    '''
+
+    # the nodes known to be in the tree of a report with an active batch,
+    # along with that batch. Nodes attached during the batch are added as they
+    # are attached and the others (such as the ancestors of the node a batch
+    # starts with) when they are first looked up, see _Batch.of
+    _members = {}
+
+    def __init__(self, report):
+
+        self._report = report
+        self._outermost = False
+        self._members = []   # added to _Batch._members by this batch
+        self._children = []  # attached while the batch is active
+        self._parents = []   # changed while the batch is active
+
+
+    def __enter__(self):
+
+        if _Batch._members.get(self._report) is None:
+            _Batch._members[self._report] = self
+            self._members.append(self._report)
+            self._outermost = True
+
+        return self._report
+
+
+    def __exit__(self, typ, value, traceback):
+
+        if not self._outermost:
+            return
+
+        for node in self._members:
+            if _Batch._members.get(node) is self:
+                del _Batch._members[node]
+
+        parents = set(self._parents)
+
+        for root in _Batch._roots(parents):
+            _Batch._rebuild_type_counts(root, parents)
+
+        for parent in parents:
+            parent._invalidate()
+
+        if typ is None:
+            for child in self._children:
+                child._parent_child_relation_checker(child._parent)
+
+
+    @staticmethod
+    def of(node):
+        '''
+        Returns
+        -------
+        the active batch of the report node belongs to, or None. The walk up
+        from node stops at the first node known to be in such a report, so
+        it is done once for the nodes of a report which has a batch.
+        '''
+
+        members = _Batch._members
+
+        if node is None or len(members)==0:
+            return None
+
+        path = []
+        batch = members.get(node)
+
+        while batch is None and node is not None:
+            path.append(node)
+            node = node._parent
+            batch = members.get(node)
+
+        if batch is not None:
+            for node in path:
+                members[node] = batch
+
+            batch._members += path
+
+        return batch
+
+
+    def _attached(self, parent, child):
+
+        _Batch._members[child] = self
+        self._members.append(child)
+        self._children.append(child)
+        self._parents.append(parent)
+
+
+    def _detached(self, parent, child):
+
+        # the branch is no longer a part of the report
+        for node in child.iter_descendants():
+            _Batch._members.pop(node, None)
+
+        self._parents.append(parent)
+
+
+    @staticmethod
+    def check_inactive(node, action):
+        '''
+        Raise a ValueError if the report of node has an active batch, since
+        the report is only brought up to date (which action relies on) when
+        the batch ends.
+        '''
+
+        if _Batch.of(node) is not None:
+            raise ValueError(f'Can not {action} while a batch is active (see Report.batch), '
+                             'the report is only brought up to date when the batch ends.')
+
+
+    @staticmethod
+    def _roots(nodes):
+        '''
+        The roots of the trees that the nodes belong to. The walk up from a
+        node stops at the first node already seen, so this is linear in the
+        size of the trees.
+        '''
+
+        seen = set()
+        roots = []
+
+        for node in nodes:
+            while node not in seen:
+                seen.add(node)
+
+                if node._parent is None:
+                    roots.append(node)
+                    break
+
+                node = node._parent
+
+        return roots
+
+
+    @staticmethod
+    def _rebuild_type_counts(root, parents):
+        '''
+        Count the nodes of each type in every subtree of root, children
+        before their parents. Nodes without children keep their counts
+        unless they lost children during the batch (i.e. are in parents).
+        '''
+
+        for node in reversed(list(root.iter_descendants())):
+            if len(node._children)==0 and node not in parents:
+                continue
+
+            type_counts = node._own_type_counts()
+
+            if len(node._children)>0:
+                type_counts = type_counts.copy()
+
+            for child in node._children:
+                for cls, count in child._type_counts.items():
+                    type_counts[cls] = type_counts.get(cls, 0) + count
+
+            _setattr(node, '_type_counts', type_counts)
+
+
+
 class _Node():
     '''
     A report is given the structure of a tree where containers and objects
@@ -117,8 +404,26 @@ class _Node():
     In the latter method, the Section and Text class initializations infer their
     parents from context (achieved through the _Context class).
 
+    Nodes keep their children (see _Children) but only weak references to
+    their parents, so a branch which is removed from a report is freed as soon
+    as it is no longer used and a node outlives its parent only if the parent
+    is kept by something else (such as a variable or a context).
+
+    Nodes are plentiful so they keep their attributes in __slots__ instead of
+    a per instance __dict__. Every subclass declares the attributes it sets
+    in its own __slots__ (see _fields).
+
     '''
 
+    # bookkeeping of the tree and of the render cache, the attributes that
+    # describe the content of a node are declared by the subclasses
+    __slots__ = ('__weakref__', '_parent_ref', '_children', '_type_counts',
+                 '_render_cache', '_dirty')
+
+    # whether rendering this type of node is expensive enough to be worth
+    # sending to a worker process when rendering with to_html(..., workers=N)
+    _render_in_pool = False
+
     def __init__(self, parent=None):
 
 
@@ -138,8 +443,23 @@ class _Node():
         else:
             assert isinstance(parent, _Node), f'parent should be a _Node but is {type(parent)}'
 
+        # number of nodes of each type (counted via isinstance so a Quote is
+        # also counted as a Text) in the subtree rooted at this node, including
+        # itself. Kept up to date by _add_child and _remove_child so that
+        # containers can answer questions like "is there any tab in here" in
+        # O(1) without scanning their descendants. Nodes without children
+        # share the counts of their type, nodes are only given their own
+        # counts (and children, see _Children) when a child is added.
+        _setattr(self, '_type_counts', self._own_type_counts())
+        _setattr(self, '_children', _NO_CHILDREN)
+
+        # rendered html fragments and other render products of this node that
+        # are kept between renders (see RenderContext.fragment). A node is dirty
+        # if it or any of its descendants changed since it was last rendered.
+        _setattr(self, '_render_cache', _NO_RENDER_CACHE)
+        _setattr(self, '_dirty', True)
+
         self._parent = parent
-        self._children = []
 
 
     def remove(self, node):
@@ -155,14 +475,18 @@ class _Node():
         subsection and remove it too.
         '''
 
-        if isinstance(node,_Node) and node in self._children:
-            node.__dict__['_parent'] = None
-            self._children.remove(node)
+        if not isinstance(node, _Node):
+            return
 
-        node_ind = 0
-        while not node._is_root and node_ind<len(self._children):
-            self._children[node_ind].remove(node)
-            node_ind += 1
+        # node is removed if self is one of its ancestors
+        parent = node._parent
+        ancestor = parent
+
+        while ancestor is not None and ancestor is not self:
+            ancestor = ancestor._parent
+
+        if ancestor is self:
+            parent._remove_child(node)
 
 
     def to_json(self,  path):
@@ -195,68 +519,216 @@ class _Node():
         to paste/display the tree somewhere, you can change the formatting.
 
         '''
+
+        _Batch.check_inactive(self, 'summarize a report')
+
         return pr._io.to_ascii(self, detailed=detailed, print_address=debug,
                         _depth=None, _print_root=self, formatting=formatting,
                         link_to_sections=link_to_sections)
 
 
+    @property
+    def _parent(self):
+
+        try:
+            parent = self._parent_ref
+        except AttributeError: # during the first initialization
+            return None
+
+        # detached copies and unpickled nodes keep their parents
+        if isinstance(parent, _weakref.ref):
+            return parent()
+
+        return parent
+
+
+    @_parent.setter
+    def _parent(self, parent):
+        '''
+        By just saying object._parent = new_parent_object, you sort out the parent child
+        relations in one go without having to worry about if you make the correct
+        changes to both the parent and the child in terms of inheritance.
+
+        There is some fascistic type checking to make sure one can not do weird
+        stuff like try to set the parent of a Report as an image etc.
+        '''
+
+        if _Batch.of(parent) is None: # checked at the end of the batch otherwise
+            self._parent_child_relation_checker(parent)
+
+        if self._parent is not None:
+            self._parent._remove_child(self)
+
+        if parent is not None:
+            parent._add_child(self)
+
+        self._set_parent(parent)
+
+
     @property
     def _is_root(self):
 
         return self._parent is None
 
 
-    def _ancestors(self, until=None):
+    def iter_ancestors(self, until=None, item_class=None):
+        '''
+        Iterate over this node and its ancestors, from this node up to the
+        root (or up to until, included, if it is one of the ancestors). If
+        item_class is given only the nodes of that type are yielded.
+        '''
 
-        ancestors = [self]
+        node = self
 
-        if self._parent is None or self==until:
-            return ancestors
-        else:
-            ancestors = self._parent._ancestors(until) + ancestors
+        while node is not None:
+            if item_class is None or isinstance(node, item_class):
+                yield node
 
-        return ancestors
+            if node is until:
+                break
 
+            node = node._parent
 
-    def _descendants(self, section_only=False):
 
-        descendants = [self]
-        iter_over = []
+    def iter_descendants(self, item_class=None, section_only=False):
+        '''
+        Iterate, in pre-order, over this node and its descendants. The tree is
+        walked with a stack holding an iterator over the children of each
+        level, so this needs memory proportional to the depth of the tree. If
+        item_class is given only the nodes of that type are yielded and the
+        branches which do not contain any (see _count) are skipped. If
+        section_only, only the sections and subsections are walked into.
+        '''
+
+        stack = [iter((self,))]
+
+        while len(stack)>0:
+            node = next(stack[-1], None)
+
+            if node is None:
+                stack.pop()
+                continue
+
+            if item_class is None or isinstance(node, item_class):
+                yield node
+
+            if len(node._children)==0:
+                continue
+
+            children = getattr(node, 'sections', ()) if section_only else node._children
+
+            if item_class is not None:
+                children = (child for child in children if child._count(item_class)>0)
+
+            stack.append(iter(children))
 
-        if section_only and hasattr(self,'sections'):
-            iter_over = self.sections
 
-        if not section_only:
-            iter_over = self._children
+    def _ancestors(self, until=None):
+
+        ancestors = list(self.iter_ancestors(until))
+        ancestors.reverse()
+
+        return ancestors
 
-        if len(iter_over)==0:
-            return descendants
 
-        for item in iter_over:
-            descendants += item._descendants(section_only=section_only)
+    def _descendants(self, section_only=False):
 
-        return descendants
+        return list(self.iter_descendants(section_only=section_only))
 
 
     def _add_child(self, child):
 
         assert isinstance(child, _Node), f'Child should be a Node object but was {type(child)}'
 
+        if self._children is _NO_CHILDREN:
+            _setattr(self, '_children', _Children())
+
         self._children.append(child)
 
+        batch = _Batch.of(self)
+
+        if batch is not None:
+            batch._attached(self, child)
+            return
+
+        self._update_type_counts(child._type_counts, 1)
+        self._invalidate()
+
 
     def _remove_child(self, child):
 
         self._children.remove(child)
+
+        batch = _Batch.of(self)
+
+        if batch is not None:
+            batch._detached(self, child)
+        else:
+            self._update_type_counts(child._type_counts, -1)
+            self._invalidate()
+
         child._set_parent(None)
 
 
+    def _update_type_counts(self, type_counts, sign):
+        '''
+        Add (sign=1) or subtract (sign=-1) the type counts of a subtree that
+        is attached to or detached from this node to the counts of this node
+        and all of its ancestors.
+        '''
+
+        node = self
+
+        while node is not None:
+            node_type_counts = node._type_counts
+
+            if node_type_counts is _OWN_TYPE_COUNTS.get(type(node)):
+                node_type_counts = node_type_counts.copy()
+                _setattr(node, '_type_counts', node_type_counts)
+
+            for cls, count in type_counts.items():
+                node_type_counts[cls] = node_type_counts.get(cls, 0) + sign*count
+
+            node = node._parent
+
+
+    @classmethod
+    def _own_type_counts(cls):
+        '''
+        Returns
+        -------
+        the dict with the type counts (see _count) of a node of type cls
+        without children, shared by all such nodes so it should not be
+        modified
+        '''
+
+        if cls not in _OWN_TYPE_COUNTS:
+            _OWN_TYPE_COUNTS[cls] = {klass:1 for klass in cls.__mro__
+                                     if issubclass(klass, _Node)}
+
+        return _OWN_TYPE_COUNTS[cls]
+
+
+    def _count(self, item_class):
+        '''
+        Return the number of nodes of type item_class in the subtree rooted at
+        this node (including itself).
+        '''
+
+        return self._type_counts.get(item_class, 0)
+
+
     def _set_parent(self, parent):
 
-        self.__dict__['_parent'] = parent
+        _setattr(self, '_parent_ref', None if parent is None else _weakref.ref(parent))
         if parent is not None and self not in parent._children:
             parent._add_child(self)
 
+        # the html of a node depends on its parent (objects are indented based
+        # on its type) so a node that is moved or removed is rendered again
+        if not self._dirty or self._render_cache:
+            self._invalidate()
+
 
     def _root(self, until=None):
 
@@ -295,6 +767,185 @@ class _Node():
             return depth
 
 
+    def _write_html(self, write, ctx=None):
+        '''
+        Stream the html of this node into write, a function that accepts str
+        fragments, so that the complete report never has to be held in memory.
+
+        The parts of the html of each node (see _html_parts) are walked with a
+        stack instead of recursion, so deeply nested reports do not run into
+        the recursion limit. Each element of the stack is the iterator over
+        the parts of a node along with the function its parts are written to.
+        '''
+
+        ctx = self._render_context(ctx)
+        stack = [(self._html_parts(ctx), write)]
+
+        while len(stack)>0:
+            parts, write = stack[-1]
+            part = next(parts, None)
+
+            if part is None:
+                stack.pop()
+            elif isinstance(part, str):
+                write(part)
+            elif isinstance(part, tuple):
+                # a child the html of which is changed by html_filter
+                child, html_filter = part
+                stack.append((child._html_parts(ctx),
+                              lambda html, write=write, html_filter=html_filter:
+                                  write(html_filter(html))))
+            else:
+                stack.append((part._html_parts(ctx), write))
+
+
+    def _html_parts(self, ctx):
+        '''
+        Iterate over the parts of the html of this node in order, these are
+        either strings of html or children of the node (optionally along with
+        a function to apply to their html) which are written in their place.
+        Objects are written as a single fragment whereas containers override
+        this to give their children one at a time.
+        '''
+
+        yield ctx.fragment(self)
+
+
+    def clear_render_cache(self):
+        '''
+        Drop the html fragments cached for this node and all its descendants
+        by previous renders with to_html(..., cache=True).
+
+        Changes made through attributes (including changes to the parent child
+        relations) invalidate the cache automatically. You only need to call
+        this if you modify something in place that the report can not know
+        about, such as an image file on disk or a DataFrame given to a Table.
+        '''
+
+        for node in self.iter_descendants():
+            _setattr(node, '_render_cache', _NO_RENDER_CACHE)
+            _setattr(node, '_dirty', True)
+
+        if self._parent is not None:
+            self._parent._invalidate()
+
+
+    def _invalidate(self):
+        '''
+        Called whenever this node changes. Drops its own cached render
+        products and marks it and all its ancestors (whose html contains the
+        html of this node) as dirty. An ancestor of a dirty node is always dirty
+        so the walk stops at the first one that is already dirty.
+        '''
+
+        _setattr(self, '_render_cache', _NO_RENDER_CACHE)
+
+        node = self
+
+        while node is not None and not node._dirty:
+            _setattr(node, '_dirty', True)
+            node = node._parent
+
+
+    def _render_cached(self, ctx, key, compute):
+        '''
+        Return the render product stored under key in the render cache of
+        this node, or compute it (and store it if ctx caches renders).
+        '''
+
+        if key in self._render_cache:
+            return self._render_cache[key]
+
+        value = compute()
+
+        if ctx.cache:
+            self._cache_render_product(key, value)
+
+        return value
+
+
+    def _cache_render_product(self, key, value):
+
+        if self._render_cache is _NO_RENDER_CACHE:
+            _setattr(self, '_render_cache', {})
+
+        self._render_cache[key] = value
+
+
+    def _detached_copy(self):
+        '''
+        Return a shallow copy of this node cut off from the rest of the tree
+        so that it can be sent to another process for rendering without
+        pickling the whole report. Its parent is replaced by an empty stand-in
+        of the same type (objects format themselves based on the type of their
+        parent) and its children and render cache are dropped.
+        '''
+
+        parent = object.__new__(type(self._parent))
+        node = object.__new__(type(self))
+
+        # the copy keeps the stand-in, nothing else refers to it
+        node.__setstate__({**self.__getstate__(), '_parent':parent,
+                           '_children':_NO_CHILDREN, '_render_cache':_NO_RENDER_CACHE})
+
+        return node
+
+
+    def _render_context(self, ctx=None):
+        '''
+        Return ctx, or a RenderContext built for the whole tree this node
+        belongs to when the node is rendered on its own (i.e. not as a part
+        of a report being rendered).
+        '''
+
+        if ctx is None:
+            ctx = _render.RenderContext(self._root())
+
+        return ctx
+
+
+    def _register_dependencies(self, ctx):
+        '''
+        Called on every node of a report before its body is rendered so that
+        objects which need scripts or styles (such as plots and maps) can add
+        them to ctx.dependencies before any of the html is written.
+        '''
+
+        pass
+
+
+    def _dependency_paths(self):
+        '''
+        Files which _register_dependencies reads (through ctx.read_bytes),
+        in the order it reads them.
+        '''
+
+        return []
+
+
+    def _asset_paths(self, ctx):
+        '''
+        Files which _generate_html reads (through ctx.read_bytes) when
+        rendered with ctx, in the order it reads them. Does not include the
+        files read by the descendants of the node.
+        '''
+
+        return []
+
+
+    def _shared_asset(self, ctx):
+        '''
+        The asset which the node embeds in the report as a tuple (source,
+        params), or None if it does not embed one. source is either the path
+        of a file (compared by content) or an object (compared by identity)
+        and params are any other inputs which the embedded asset depends on.
+        Nodes with equal assets can be rendered once and referred to
+        elsewhere, see RenderContext._share_assets.
+        '''
+
+        return None
+
+
     def _check_types(self, arg_names, args, expected_types, fun_name):
         '''
         This is a function used to check function input types for methods of _Node derived
@@ -306,11 +957,10 @@ class _Node():
         if not isinstance(args,list):args = [args]
         if not isinstance(expected_types,list):expected_types = [expected_types]
 
-        class_name = _re.search(r'\.[^\.\']+\'',str(type(self))).group()[1:-1]
-
         for arg_name, arg, expected_type in zip(arg_names, args, expected_types):
             if not isinstance(arg, expected_type):
 
+                class_name = _re.search(r'\.[^\.\']+\'',str(type(self))).group()[1:-1]
                 arg_type = type(arg)
 
                 raise ValueError(f'{arg_name} input to {class_name}.{fun_name} '
@@ -327,7 +977,7 @@ class _Node():
         if parent is not None and not isinstance(parent, _Node):
             raise ValueError(f'parent should be None or _Node but is {type(parent)}')
 
-        if type(parent) in dir(pr.objects):
+        if type(parent).__module__ == __name__:
             raise ValueError('classes from objects module can not be a parent '
                              f'(in this case a {type(parent)} was set as parent).')
 
@@ -339,35 +989,70 @@ class _Node():
             raise ValueError('Parent of a Section can only be a Report, Section '
                              f' or None but it was {type(parent)}.')
 
-        if type(self) in dir(pr.objects) and isinstance(type(parent), pr.containers.Report):
-            raise ValueError('classes from objects can not be children of a Report.')
-
 
     def __setattr__(self, key, value):
 
         '''
-        By modifying setattr we provide a convenient way to remove nodes
-        or branches from the graph
+        Any change to a node invalidates the html cached for it and its
+        ancestors. Changes of the parent are sorted out by the _parent
+        property.
+        '''
 
-        By just saying object._parent = new_parent_object, you sort out the parent child
-        relations in one go without having to worry about if you make the correct
-        changes to both the parent and the child in terms of inheritance.
+        _setattr(self, key, value)
 
-        There is some fascistic type checking to make sure one can not do weird
-        stuff like try to set the parent of a Report as an image etc.
+        try:
+            if self._dirty and not self._render_cache:
+                return
+        except AttributeError: # during initialization
+            return
+
+        self._invalidate()
+
+
+    @classmethod
+    def _slots(cls):
+        '''
+        Returns
+        -------
+        list of the names of the slots declared by cls and its bases
+        '''
+
+        return [slot for klass in reversed(cls.__mro__)
+                for slot in klass.__dict__.get('__slots__', ())]
+
+
+    @classmethod
+    def _fields(cls):
         '''
+        Returns
+        -------
+        list of the names of the attributes that describe the content of
+        nodes of type cls (used when saving them as json), that is all slots
+        except the ones used for the bookkeeping of the tree and the cache
+        '''
+
+        return [slot for slot in cls._slots() if slot not in _Node.__slots__]
+
+
+    def __getstate__(self):
+
+        # weak references can not be pickled, unpickled nodes keep their parents
+        state = {slot:getattr(self, slot) for slot in self._slots()
+                 if slot not in ('__weakref__', '_parent_ref') and hasattr(self, slot)}
+        state['_parent'] = self._parent
+
+        if state.get('_render_cache') is _NO_RENDER_CACHE: # can not be pickled
+            del state['_render_cache']
 
-       	if key == '_parent':
+        return state
 
-            self._parent_child_relation_checker(value)
 
-            if hasattr(self, '_parent') and self._parent is not None:
-                self._parent._remove_child(self)
+    def __setstate__(self, state):
 
-            if value is not None:
-                value._add_child(self)
+        _setattr(self, '_render_cache', _NO_RENDER_CACHE)
 
-       	self.__dict__[key] = value
+        for key, value in state.items():
+            _setattr(self, '_parent_ref' if key == '_parent' else key, value)
 
 
     def __str__(self, _depth=None, _print_root=None):
@@ -380,6 +1065,8 @@ class _Node():
         simple class
         '''
 
+        _Batch.check_inactive(self, 'summarize a report')
+
         return pr._io.to_ascii(self, detailed=True, print_address=False,
                         _depth=None, _print_root=self)
 
@@ -391,6 +1078,8 @@ class Link(_Node):
     Link object: It is a link.
     """
 
+    __slots__ = ('_link', '_link_title', '_link_style', '_end')
+
     def __init__(self, link, link_title=None, parent=None, link_style = None,
                  end='<br><br>'):
 
@@ -415,9 +1104,9 @@ class Link(_Node):
         self._end = end
 
 
-    def _generate_html(self):
+    def _generate_html(self, ctx=None):
 
-        parent_depth = self._parent._depth
+        parent_depth = self._render_context(ctx).depth[self._parent]
 
         return '\n' + '    '*(parent_depth + 1) + f'<a href="{self._link}" style="{self._link_style}">{self._link_title}</a>\n' + self._end
 
@@ -427,10 +1116,26 @@ class Code(_Node):
     """
     Code object: Prints a code on the html page with syntax highlighting
     using code-prettify.js https://github.com/googlearchive/code-prettify
+
+    If highlight is pygments, the code is instead highlighted while rendering
+    the report (this requires pygments) as the given language. The code styles
+    apply the same and code-prettify.js is not added to reports all the code of
+    which is highlighted this way.
     """
 
+    __slots__ = ('_code_text', '_linenums', '_end', '_fold_code', '_highlight',
+                 '_language')
+
     def __init__(self, code_text:str, parent:_Node=None, linenums:int=None,
-                  end:str= ' ', fold_code=True):
+                  end:str= ' ', fold_code=True, highlight:str='prettify',
+                  language:str='python'):
+
+        if highlight not in ['prettify', 'pygments']:
+            raise ValueError('highlight should be either prettify or pygments '
+                             f'but was {highlight}.')
+        if highlight == 'pygments' and not _internal.has_pygments():
+            raise ImportError('pygments needs to be installed to highlight code '
+                              'with it.')
 
         if fold_code and not _Context._loading_from_json:
             fold = pr.containers.Fold()
@@ -438,15 +1143,17 @@ class Code(_Node):
         else:
             pr.objects._Node.__init__(self, parent)
 
-        self._check_types(['code_text', 'parent', 'linenums', 'end','fold_code'],
-                          [code_text, parent, linenums, end, fold_code],
-                          [str, (_Node,_NoneType), (int,_NoneType), str, bool],
+        self._check_types(['code_text', 'parent', 'linenums', 'end','fold_code', 'language'],
+                          [code_text, parent, linenums, end, fold_code, language],
+                          [str, (_Node,_NoneType), (int,_NoneType), str, bool, str],
                           '__init__')
 
         self._code_text = code_text
         self._linenums = linenums
         self._end = end
         self._fold_code = fold_code
+        self._highlight = highlight
+        self._language = language
 
 
     def _format_code_text(self, text):
@@ -459,15 +1166,36 @@ class Code(_Node):
         return code_text
 
 
-    def _generate_html(self):
+    def _highlighted_code_text(self, text):
+        '''
+        text highlighted by pygments, with line numbers as code-prettify would
+        add them if linenums is given.
+        '''
+
+        lines = _internal.highlight_code(text, self._language)
 
-        tag = ('\n<pre class="prettyprint"' +
-               'linenums:{self._linenums}"'*(self._linenums is not None) +
-               '>'
-               )
+        if self._linenums is None:
+            return '\n'.join(lines)
+
+        items = ''.join(f'<li class="L{i%10}">{line}</li>' for i,line in enumerate(lines))
+
+        return f'<ol class="linenums" start="{self._linenums}">{items}</ol>'
+
+
+    def _generate_html(self, ctx=None):
 
         formatted_code_text = self._format_code_text(self._code_text)
 
+        if self._highlight == 'pygments':
+            # marked as prettyprinted so that code-prettify leaves it alone
+            tag = '\n<pre class="prettyprint prettyprinted">'
+            formatted_code_text = self._highlighted_code_text(formatted_code_text)
+        else:
+            tag = ('\n<pre class="prettyprint"' +
+                   'linenums:{self._linenums}"'*(self._linenums is not None) +
+                   '>'
+                   )
+
         html_str =  f'{tag}\n'
         html_str += '\n' + f'{formatted_code_text}\n'
         html_str += '</pre>\n'
@@ -483,6 +1211,8 @@ class Text(_Node):
     object as it needs a parent
     """
 
+    __slots__ = ('_text', '_font_size', '_alignment', '_end', '_style', '_formatted')
+
     def __init__(self, text, parent=None, font_size=16, alignment='left', end='',
                  style='', formatted=False):
 
@@ -502,25 +1232,23 @@ class Text(_Node):
         self._style = style
         self._formatted = formatted
 
-    def _format_text(self, text):
-
-        parent_depth = self._parent._depth
+    def _format_text(self, text, parent_depth):
 
         text = _internal.format_text(text, parent_depth, formatted=self._formatted)
 
         return text
 
 
-    def _generate_html(self):
+    def _generate_html(self, ctx=None):
 
-        parent_depth = self._parent._depth
+        parent_depth = self._render_context(ctx).depth[self._parent]
         text = self._text
         style = self._style
 
         tags = [f'<p style = "font-size:{str(self._font_size)}px; text-align:{self._alignment}; {style}">','</p>']
         endline = '\n'
 
-        text = self._format_text(text)
+        text = self._format_text(text, parent_depth)
         text_html = endline + '    '*(parent_depth + 1) + f'{tags[0]}' + endline
         text_html += f'{text}' + endline
         text_html += '    '*(parent_depth + 1) +f'{tags[1]}' + self._end + endline
@@ -528,8 +1256,23 @@ class Text(_Node):
         return text_html
 
 
+    def _is_empty(self, html):
+        '''
+        Whether html, the html of the text (as placed in a Grid), shows no
+        text. This does not depend on the position of the text so it is only
+        computed again when the text is modified.
+        '''
+
+        if 'empty' not in self._render_cache:
+            self._cache_render_product('empty', _internal.html_is_blank(html))
+
+        return self._render_cache['empty']
+
+
 class Quote(Text):
 
+    __slots__ = ()
+
     def __init__(self, text, parent=None, font_size=16, alignment='left',
                  end=''):
 
@@ -548,6 +1291,8 @@ class PDF(_Node):
   Given an address for a pdf file, this will embed it inside the report.
   '''
 
+  __slots__ = ('_pdf_path', '_end', '_width', '_height', '_style')
+
   def __init__(self, pdf_path, parent=None, width=None, height=None,  end='<br>',
                style=''):
 
@@ -561,12 +1306,13 @@ class PDF(_Node):
       self._height = height
       self._style = style
 
-  def _generate_html(self):
+  def _generate_html(self, ctx=None):
 
       pdf_html = '<br>'
       w = ""
       h = ""
-      parent_depth = self._parent._depth
+      ctx = self._render_context(ctx)
+      parent_depth = ctx.depth[self._parent]
 
       if isinstance(self._parent, pr.containers.Section):
           indent = '    '*(parent_depth + 1)
@@ -578,7 +1324,12 @@ class PDF(_Node):
       if self._height is not None:
         h = f"height=\"{self._height}\""
 
-      pdf_html += '\n' + indent + f'<embed src="{self._pdf_path}" {w} {h} type="application/pdf" style="{self._style}">'
+      if ctx.assets is not None and _os.path.isfile(self._pdf_path):
+        src = ctx.assets.link(self._pdf_path, ctx.read_bytes(self._pdf_path))
+      else:
+        src = self._pdf_path
+
+      pdf_html += '\n' + indent + f'<embed src="{src}" {w} {h} type="application/pdf" style="{self._style}">'
 
 
       pdf_html +=  self._end + '\n'
@@ -587,6 +1338,14 @@ class PDF(_Node):
       return pdf_html
 
 
+  def _asset_paths(self, ctx):
+
+      if ctx.assets is not None and _os.path.isfile(self._pdf_path):
+        return [self._pdf_path]
+
+      return []
+
+
 
 class AcMap(_Node):
 
@@ -595,6 +1354,10 @@ class AcMap(_Node):
     the report.
     '''
 
+    __slots__ = ('_acmap', '_end', '_width', '_height', '_xscale', '_yscale')
+
+    _render_in_pool = True
+
     def __init__(self, acmap, parent=None, width=None, height=None, xscale=1,
                  yscale=1, end='<br>'):
 
@@ -612,17 +1375,39 @@ class AcMap(_Node):
         self._yscale = yscale
 
 
-    def _generate_html(self):
+    def _html_tokens(self, ctx=None):
 
-        with open(self._acmap) as fp:
-            lines = ''.join(fp.readlines())
+        if ctx is None:
+            ctx = _render.RenderContext(None)
 
-        html_tokens = _internal.html_tokenizer(lines)
+        lines = ctx.read_text(self._acmap)
+
+        return _internal.html_tokenizer(lines)
+
+
+    def _dependency_paths(self):
+
+        return [] if 'head' in self._render_cache else [self._acmap]
+
+
+    def _asset_paths(self, ctx):
+
+        return [self._acmap]
+
+
+    def _register_dependencies(self, ctx):
+
+        head_tokens = self._render_cached(ctx, 'head', lambda: self._html_tokens(ctx)['head'])
+
+        for token in head_tokens:
+            ctx.dependencies.add('    ' + token.strip('\n') + '\n')
+
+
+    def _generate_html(self, ctx=None):
+
+        html_tokens = self._html_tokens(ctx)
 
         body_html = html_tokens['body']
-        for token in html_tokens['head']:
-            if  token not in self._root()._CONFIG['SCRIPTS']['USER SCRIPTS']:
-                self._root()._CONFIG['SCRIPTS']['USER SCRIPTS'] += '    ' + token.strip('\n') + '\n'
 
 
         I = _re.search(r'style="width:\d*px;height:\d*px',body_html)
@@ -662,6 +1447,11 @@ class Plot(_Node):
 
     '''
 
+    __slots__ = ('_plot', '_end', '_width', '_height', '_xscale', '_yscale',
+                 '_change_id')
+
+    _render_in_pool = True
+
     def __init__(self, plot, parent=None,  width=None, height=None, xscale=1,
                  yscale=1, end='<br>', change_id=False):
 
@@ -676,17 +1466,138 @@ class Plot(_Node):
         self._change_id = change_id
 
 
-    def _generate_html(self):
+    def _html_tokens(self, ctx=None, keep=False):
+        '''
+        The head and body of the html of the plot. If keep, they are kept in
+        ctx and used by the next call with the same ctx, so that a plot is read
+        and tokenized, and a figure encoded, once per render: while registering
+        the dependencies and not again when generating the html.
+        '''
+
+        if ctx is not None and self in ctx.html_tokens:
+            return ctx.html_tokens.pop(self)
 
         if isinstance(self._plot, str):
-            with open(self._plot) as fp:
-                lines = ''.join(fp.readlines())
+            lines = (_render.RenderContext(None) if ctx is None else ctx).read_text(self._plot)
 
         else:
-            lines = _plotly.io.to_html(self._plot)
+            # plotly.js is added to the report once (see _register_dependencies)
+            # or to the plot if needed (see _body_html)
+            import plotly.io
+            lines = plotly.io.to_html(self._plot, include_plotlyjs=ctx is None)
 
         html_tokens = _internal.html_tokenizer(lines)
 
+        if keep and ctx is not None:
+            ctx.html_tokens[self] = html_tokens
+
+        return html_tokens
+
+
+    def _dependency_paths(self):
+
+        if 'head' in self._render_cache or not isinstance(self._plot, str):
+            return []
+
+        return [self._plot]
+
+
+    def _asset_paths(self, ctx):
+
+        # the plot read while registering its dependencies is used again
+        # (see _html_tokens) unless its head was cached by an earlier render
+        if 'head' not in self._render_cache or not isinstance(self._plot, str):
+            return []
+
+        return [self._plot]
+
+
+    def _shared_asset(self, ctx):
+
+        if ctx.assets is not None:
+            # the scripts of the plot are already stored once as files, and
+            # copies of a template would refer to ids inside those files
+            return None
+
+        return (self._plot, (self._width, self._height, self._xscale, self._yscale))
+
+
+    def _head(self, ctx):
+
+        html_tokens = self._html_tokens(ctx, keep=True)
+
+        if isinstance(self._plot, str):
+            _, version, bundle = _internal.split_plotlyjs(html_tokens['body'])
+
+            if version is not None:
+                ctx.plotly_bundles.setdefault(version, bundle)
+
+            return html_tokens['head'], version, self._plot
+
+        return html_tokens['head'], _render.installed_plotlyjs_version(), None
+
+
+    def _register_dependencies(self, ctx):
+
+        head_tokens, version, source = self._render_cached(ctx, 'head', lambda: self._head(ctx))
+
+        if version is not None:
+            ctx.require_plotlyjs(version, source)
+
+        for token in head_tokens:
+            if '<meta' not in token and '<style' not in token:
+                ctx.dependencies.add('    ' + token.strip('\n') + '\n')
+
+
+    def _generate_html(self, ctx=None):
+
+        shared_asset = None if ctx is None else ctx.shared_assets.get(self)
+
+        if shared_asset is not None:
+            asset_id, first = shared_asset
+            ref_html = f'<div data-asset-ref="{asset_id}"></div>' + self._end + '\n'
+
+            if not first:
+                return ref_html
+
+            # the plot is kept in a template which is copied (with new div ids)
+            # into each of the nodes referring to it when the page is loaded
+            return f'<template data-asset="{asset_id}">{self._body_html(ctx)}</template>\n' + ref_html
+
+        body_html = self._body_html(ctx)
+
+        if ctx is not None and ctx.assets is not None:
+            body_html = ctx.assets.externalize_scripts(body_html)
+
+        return body_html + self._end + '\n'
+
+
+    def _body_html(self, ctx):
+
+        html_tokens = self._html_tokens(ctx)
+
+        if (not isinstance(self._plot, str) and ctx is not None and ctx.plotly_version is not None
+            and ctx.plotly_version[0] != _render.installed_plotlyjs_version()[0]):
+            # the report uses a different major version of plotly.js so the
+            # figure needs its own, as plotly.io.to_html would include it
+            import plotly.offline
+            body_html = html_tokens['body']
+            ind = body_html.index('<div class="plotly-graph-div"')
+            html_tokens['body'] = (body_html[:ind] +
+                                   '<script>window.PlotlyConfig = {MathJaxConfig: \'local\'};</script>\n'
+                                   f'<script>{plotly.offline.get_plotlyjs()}</script> ' + body_html[ind:])
+
+        body_html, version, _ = _internal.split_plotlyjs(html_tokens['body'])
+
+        if version is not None and ctx is not None and ctx.plotly_version is not None:
+            if version[0] == ctx.plotly_version[0]:
+                # the plotly.js in the head of the report is used instead
+                html_tokens['body'] = body_html
+            else:
+                # keep the bundle of this plot but restore the one in the head
+                # for the plots after it
+                html_tokens['body'] += '<script type="text/javascript">window.Plotly = window.PyReportsPlotly;</script>'
+
         if self._change_id:
             # Note that if you try to include the same plotly plot twice in the same document,
             # it will fail unless it is div-id is changed. This is what this part does.
@@ -700,11 +1611,7 @@ class Plot(_Node):
 
             html_tokens['body'] = html_tokens['body'].replace(div_id,new_id)
 
-        for token in html_tokens['head']:
-            if '<meta' not in token and '<style' not in token and token not in self._root()._CONFIG['SCRIPTS']['USER SCRIPTS']:
-                self._root()._CONFIG['SCRIPTS']['USER SCRIPTS'] += '    ' + token.strip('\n') + '\n'
-
-        div_html = html_tokens['body'] + self._end + '\n'
+        div_html = html_tokens['body']
 
         if self._height is not None or self._width is not None or self._xscale != 1 or self._yscale != 1:
             I = _re.search(r'class="plotly-graph-div" style="height:.*px; width:.*px;',html_tokens['body']).group()
@@ -740,20 +1647,69 @@ class Image(_Node):
     it to bytes. In such a case you don't need to keep a copy of the figure to
     load it to the report. Text is the title that will be displayed
 
+    An embedded image can also be transcoded: it is then resampled to its displayed
+    size times dpr (it is never enlarged) and encoded as transcode (png, jpeg or webp)
+    with the given quality. srcset is a list of further pixel densities (such as [2])
+    for which resampled copies are added to the srcset of the image.
+
+    A figure is saved once in fig_format (png, jpeg or svg) with the given dpi
+    (defaults to that of savefig). simplify is the threshold of the simplification
+    of the paths of the figure, if given.
+
     It is not meant to be initialized from scratch but should be called from a Section object
     """
 
+    __slots__ = ('_image', '_width', '_height', '_embed', '_title', '_scale', '_end',
+                 '_style', '_transcode', '_quality', '_dpr', '_srcset', '_fig_format',
+                 '_dpi', '_simplify')
+
+    _render_in_pool = True
+
     def __init__(self, image, parent=None, width=None, height=None, title=None, scale=1,
-                 embed=True, style=None, end='<br>'):
+                 embed=True, style=None, end='<br>', transcode=None, quality=85,
+                 dpr=1, srcset=None, fig_format='png', dpi=None, simplify=None):
+
+        fig_format = {'jpg':'jpeg'}.get(fig_format.lower(), fig_format.lower())
+
+        if fig_format not in _internal._FIGURE_FORMATS:
+            raise ValueError('fig_format should be one of '
+                             f'{list(_internal._FIGURE_FORMATS)} but was {fig_format}.')
+        if ((fig_format != 'png' or dpi is not None or simplify is not None) and
+            not _internal.is_figure(image)):
+            raise ValueError('fig_format, dpi and simplify can only be given for '
+                             'matplotlib figures.')
+        if dpi is not None:
+            assert dpi>0, f'dpi should be positive but is {dpi}'
+        if simplify is not None:
+            assert 0<=simplify<=1, f'simplify should be between 0 and 1 but is {simplify}'
+
+        if transcode is not None or srcset is not None:
+            if transcode is not None:
+                transcode = {'jpg':'jpeg'}.get(transcode.lower(), transcode.lower())
+
+                if transcode not in _internal._TRANSCODE_FORMATS:
+                    raise ValueError('transcode should be one of '
+                                     f'{list(_internal._TRANSCODE_FORMATS)} but was {transcode}.')
+            if not embed:
+                raise ValueError('Only embedded images can be transcoded.')
+
+            assert dpr>0, f'dpr should be positive but is {dpr}'
+            assert 1<=quality<=100, f'quality should be between 1 and 100 but is {quality}'
+
+            if srcset is not None:
+                srcset = list(srcset)
+                assert all(x>0 for x in srcset), f'densities in srcset should be positive but are {srcset}'
 
         pr.objects._Node.__init__(self, parent)
 
         if width is not None and height is not None:
             assert  width>0 and height>0,f'Width and height should be positive but they are {width} and {height}'
         else:
+            from PIL import Image
+
             if isinstance(image,(str,PosixPath)):
                 with open(str(image), "rb") as fp:
-                  pimage = _PIL.Image.open(fp)
+                  pimage = Image.open(fp)
 
                 width, height = pimage.size
             elif image is None:
@@ -761,11 +1717,11 @@ class Image(_Node):
                     width = 0
                 if height is None:
                     height = 0
-                pimage = _PIL.Image.new('RGB', (width,height))
+                pimage = Image.new('RGB', (width,height))
                 width, height = pimage.size
-            elif isinstance(image, _mpl.figure.Figure):
+            elif _internal.is_figure(image):
                 width, height = image.get_size_inches()*image.dpi
-            elif isinstance(image, _PIL.Image.Image):
+            elif _internal.is_pil_image(image):
                 width, height = image.size
             else:
                 raise ValueError(f'image should be str or mpl figure but is {type(image)}')
@@ -791,12 +1747,20 @@ class Image(_Node):
         self._scale = scale
         self._end = end
         self._style = style
+        self._transcode = transcode
+        self._quality = quality
+        self._dpr = dpr
+        self._srcset = srcset
+        self._fig_format = fig_format
+        self._dpi = dpi
+        self._simplify = simplify
 
 
-    def _generate_html(self):
+    def _generate_html(self, ctx=None):
 
         img_html = '<br>'
-        parent_depth = self._parent._depth
+        ctx = self._render_context(ctx)
+        parent_depth = ctx.depth[self._parent]
 
         if isinstance(self._parent, pr.containers.Section):
             indent = '    '*(parent_depth + 1)
@@ -808,36 +1772,32 @@ class Image(_Node):
         else:
             title_str = f'{self._title}<br>'
 
-        if self._embed:
-
-            if isinstance(self._image, (str,PosixPath)):
-                with open(str(self._image), 'rb') as fp:
-                    img_bytes = fp.read()
-
-                if self._width is None and self._height is None:
-                    pimage = _PIL.Image.open(self._image)
-                    width, height = pimage.size
-            elif isinstance(self._image, _mpl.figure.Figure):
-                img = _internal.fig2img(self._image)
-                img_bytes = _internal.image_to_byte_array(img)
-
-                if self._width is None and self._height is None:
-                    width, height = self._image.get_size_inches()*self._image.dpi
-            elif isinstance(self._image, _PIL.Image.Image):
-                img = self._image
-                img_bytes = _internal.image_to_byte_array(img)
-            elif self._image is None:
-                img_bytes = b''
+        shared_asset = ctx.shared_assets.get(self)
+
+        if shared_asset is not None and not shared_asset[1]:
+            # the same image is embedded earlier in the report
+            img_html += '\n' + indent + f'{title_str}<img data-asset-ref="{shared_asset[0]}" title="{self._title}" width="{self._width}" height="{self._height}" style="{self._style}">'
+
+        elif self._embed:
+
+            if self._is_transcoded:
+                src, srcset = self._transcoded_sources(ctx)
+                srcset_str = '' if srcset == '' else f' srcset="{srcset}"'
             else:
-                raise ValueError(f'An embeddable image must either be a maplot image object or a path to an image but was instead {type(self._image)}')
+                src, srcset_str = self._source(ctx), ''
 
-            self._base64_img = _b64.b64encode(img_bytes).decode("utf-8")#
+            asset_str = '' if shared_asset is None else f' data-asset="{shared_asset[0]}"'
 
-            img_html += '\n' + indent + f'{title_str}<img src="data:image/png;base64,{self._base64_img}" title="{self._title}" width="{self._width}" height="{self._height}" style="{self._style}">'
+            img_html += '\n' + indent + f'{title_str}<img src="{src}"{srcset_str}{asset_str} title="{self._title}" width="{self._width}" height="{self._height}" style="{self._style}">'
         else:
             assert isinstance(self._image,str), 'If not embedded image input should be the path of the image'
 
-            img_html += '\n' + indent + f'{title_str}<img src="{self._image}" width="{self._width}" height="{self._height}" style="{self._style}">'
+            if ctx.assets is not None and _os.path.isfile(self._image):
+                src = ctx.assets.link(self._image, ctx.read_bytes(self._image))
+            else:
+                src = self._image
+
+            img_html += '\n' + indent + f'{title_str}<img src="{src}" width="{self._width}" height="{self._height}" style="{self._style}">'
 
         img_html +=  self._end + '\n'
 
@@ -845,11 +1805,164 @@ class Image(_Node):
         return img_html
 
 
+    @property
+    def _is_transcoded(self):
+
+        return self._image is not None and (self._transcode is not None or
+                                            self._srcset is not None)
+
+
+    def _pil_image(self, ctx):
+        '''
+        The image as a PIL image.
+        '''
+
+        from PIL import Image
+
+        if isinstance(self._image, (str,PosixPath)):
+            return Image.open(_pyio.BytesIO(ctx.read_bytes(self._image)))
+        elif _internal.is_figure(self._image):
+            return Image.open(_pyio.BytesIO(self._figure_bytes('png')))
+        elif _internal.is_pil_image(self._image):
+            return self._image
+        else:
+            raise ValueError(f'An embeddable image must either be a maplot image object or a path to an image but was instead {type(self._image)}')
+
+
+    def _figure_bytes(self, fig_format):
+
+        return _internal.figure_to_bytes(self._image, fig_format, self._dpi,
+                                         self._quality, self._simplify)
+
+
+    def _source(self, ctx):
+        '''
+        src of the embedded image, either a data uri or (when assets are
+        written to a sidecar directory) the url of its file.
+        '''
+
+        if self._image is None:
+            img_bytes = b''
+            mime_type = 'image/png'
+        elif isinstance(self._image, (str,PosixPath)):
+            img_bytes = ctx.read_bytes(self._image)
+
+            if ctx.assets is not None:
+                return ctx.assets.link(self._image, img_bytes)
+
+            mime_type = _internal.image_mime_type(img_bytes, self._image)
+        elif _internal.is_figure(self._image):
+            img_bytes = self._figure_bytes(self._fig_format)
+            mime_type, suffix = _internal._FIGURE_FORMATS[self._fig_format]
+
+            if ctx.assets is not None:
+                return ctx.assets.store(img_bytes, suffix)
+        else:
+            img = self._pil_image(ctx)
+            img_bytes = _internal.image_to_byte_array(img)
+            image_format = img.format or 'png'
+
+            if ctx.assets is not None:
+                return ctx.assets.store(img_bytes, '.' + image_format.lower())
+
+            from PIL import Image
+            mime_type = Image.MIME.get(image_format.upper(), 'image/png')
+
+        return _internal.data_uri(img_bytes, mime_type)
+
+
+    def _densities(self):
+        '''
+        pixel densities of the src of the image followed by those of the
+        srcset, duplicates removed.
+        '''
+
+        return list(dict.fromkeys([self._dpr] + (self._srcset or [])))
+
+
+    def _transcoded_sources(self, ctx):
+        '''
+        src and srcset (empty if there are no further densities) of the
+        transcoded image. The src has density dpr and is only repeated in the
+        srcset if dpr is not 1, otherwise the browser takes it as the 1x image
+        of the srcset anyway.
+        '''
+
+        img = self._pil_image(ctx)
+
+        if self._transcode is None:
+            image_format = {'jpg':'jpeg'}.get((img.format or 'png').lower(), (img.format or 'png').lower())
+            if image_format not in _internal._TRANSCODE_FORMATS:
+                image_format = 'png'
+        else:
+            image_format = self._transcode
+
+        suffix = _internal._TRANSCODE_FORMATS[image_format][1]
+        mime_type = f'image/{image_format}'
+        urls = []
+
+        for density in self._densities():
+            size = (round(self._width*density), round(self._height*density))
+            img_bytes = _internal.transcode_image(img, size, image_format, self._quality)
+
+            if ctx.assets is None:
+                urls.append((_internal.data_uri(img_bytes, mime_type), density))
+            else:
+                urls.append((ctx.assets.store(img_bytes, suffix), density))
+
+        if self._srcset is None:
+            return urls[0][0], ''
+
+        srcset = [f'{url} {density:g}x' for url, density
+                  in (urls[1:] if self._dpr == 1 else urls)]
+
+        return urls[0][0], ', '.join(srcset)
+
+
+    def _asset_paths(self, ctx):
+
+        if self._embed and isinstance(self._image, (str,PosixPath)):
+            return [self._image]
+
+        if not self._embed and ctx.assets is not None and _os.path.isfile(self._image):
+            return [self._image]
+
+        return []
+
+
+    def _shared_asset(self, ctx):
+
+        if not self._embed or self._image is None:
+            return None
+
+        if self._is_transcoded:
+            return (self._image, (self._transcode, self._quality, self._width,
+                                  self._height, tuple(self._densities()), self._dpi))
+
+        if _internal.is_figure(self._image):
+            return (self._image, (self._fig_format, self._dpi, self._quality,
+                                  self._simplify))
+
+        return (self._image, ())
+
+
 class Table(_Node):
     """
     """
+
+    __slots__ = ('_table', '_background_colors', '_row_style', '_header_style',
+                 '_cell_colors', '_mode')
+
+    _render_in_pool = True
+
     def __init__(self, table, background_colors=None, parent=None,
-                 header_style=None, row_style=None, cell_colors=None):
+                 header_style=None, row_style=None, cell_colors=None,
+                 mode='static'):
+
+        if mode not in ['static', 'virtual']:
+            raise ValueError('mode should be either static (every row is an '
+                             'html element) or virtual (the data is embedded '
+                             f'as json and only the visible rows are shown) but was {mode}.')
 
         pr.objects._Node.__init__(self, parent)
 
@@ -880,46 +1993,129 @@ class Table(_Node):
         self._row_style = row_style
         self._header_style = header_style
         self._cell_colors = cell_colors
+        self._mode = mode
+
+    def _generate_html(self, ctx=None):
 
-    def _generate_html(self):
+        ctx = self._render_context(ctx)
 
         table_html = '\n'
-        parent_depth = self._parent._depth
+        parent_depth = ctx.depth[self._parent]
 
         if isinstance(self._parent, pr.containers.Section):
             indent = '    '*(parent_depth + 1)
         else:
             indent = '    '*(parent_depth)
 
+        classes = self._render_cached(ctx, 'classes', lambda: self._classes)
+
+        if self._mode == 'virtual':
+            return table_html + self._generate_virtual_html(indent, classes)
+
         table_html += indent + '<table class="sortable">\n\n'
-        table_html += '\n'.join([indent + '  ' + x for x in self._generate_colnames_html(self._table.columns, self._header_style).split('\n')]) + '\n\n'
+        table_html += '\n'.join([indent + '  ' + x for x in self._generate_colnames_html(self._table.columns, self._header_style, classes).split('\n')]) + '\n\n'
         table_html += indent + '  <tbody>\n'
+        table_html += ''.join(self._generate_rows_html(indent + '  ', classes))
+        table_html += indent + '  </tbody>\n\n'
 
-        for bcolor,ccolors, row in zip(self._background_colors,
-                                      self._cell_colors,
-                                      self._table.iterrows()):
-          row_style = self._row_style
-          cell_styles = []
+        table_html += indent + '</table>'
 
-          if bcolor is not None:
-              row_style += f'background-color:{bcolor}'
+        return table_html
 
-          cell_styles = [f'background-color:{ccolor}' if ccolor is not None
-                         else '' for ccolor in ccolors]
+    def _generate_virtual_html(self, indent, classes):
+        '''
+        html of a virtual table: the header and an empty body which the
+        VIRTUAL TABLE SCRIPT fills with the visible rows, using the data
+        embedded as columnar json.
+        '''
 
-          table_html += '\n'.join([indent + '  ' + x for x in self._generate_row_html(row[1], row_style, cell_styles).split('\n')]) + '\n'
+        values = self._table.values
 
-        table_html += indent + '  </tbody>\n\n'
+        row_styles = [self._row_style if bcolor is None
+                      else self._row_style + f'background-color:{bcolor}'
+                      for bcolor in self._background_colors]
+        if all(bcolor is None for bcolor in self._background_colors):
+            row_styles = self._row_style
 
-        table_html += indent + '</table>'
+        cell_styles = []
+        for i in range(len(classes)):
+            colors = [row_colors[i] for row_colors in self._cell_colors]
+            if all(color is None for color in colors):
+                cell_styles.append(None)
+            else:
+                cell_styles.append(['' if color is None else f'background-color:{color}'
+                                    for color in colors])
+
+        data = {'nrows':self._table.shape[0],
+                'columns':[self._column_strings(values, i, '') for i in range(len(classes))],
+                'num':['num' in td_class for td_class in classes],
+                'rowStyles':row_styles,
+                'cellStyles':cell_styles}
+
+        # the json can not end the script it is in
+        data_json = _json.dumps(data, separators=(',',':'), ensure_ascii=False)
+        data_json = data_json.replace('<', '\\u003c').replace('>', '\\u003e').replace('&', '\\u0026')
+
+        table_html = indent + '<div class="virtual-table">\n'
+        table_html += indent + '  <table class="sortable virtual">\n\n'
+        table_html += '\n'.join([indent + '    ' + x for x in self._generate_colnames_html(self._table.columns, self._header_style, classes).split('\n')]) + '\n\n'
+        table_html += indent + '    <tbody></tbody>\n\n'
+        table_html += indent + '  </table>\n'
+        table_html += indent + f'  <script type="application/json" class="table-data">{data_json}</script>\n'
+        table_html += indent + '</div>'
 
         return table_html
 
-    def _generate_colnames_html(self, col_names, style=''):
+    def _generate_rows_html(self, indent, classes):
+        '''
+        html of the rows of the table, one string per row. The table is
+        formatted column by column and each row is then put together with a
+        single join so no Series is created per row.
+        '''
+
+        # cells are formatted as DataFrame.iterrows would give them, that is
+        # after coercing all the columns to a common dtype
+        values = self._table.values
+        columns = []
+
+        for i,td_class in enumerate(classes):
+            prefix = f'{indent}   <td {td_class}style="'
+            cell_styles = ['' if row_colors[i] is None else f'background-color:{row_colors[i]}'
+                           for row_colors in self._cell_colors]
+
+            columns.append([f'{prefix}{cell_style}">{elem}</td>\n' for cell_style,elem
+                            in zip(cell_styles, self._column_strings(values, i, indent))])
+
+        row_styles = [self._row_style if bcolor is None
+                      else self._row_style + f'background-color:{bcolor}'
+                      for bcolor in self._background_colors]
+
+        return [f'{indent}  <tr style="{row_style}">\n' + ''.join(cells) + f'{indent}  </tr>\n'
+                for row_style, *cells in zip(row_styles, *columns)]
+
+    def _column_strings(self, values, i, indent):
+        '''
+        the i^th column of values, the coerced values of the table, as strings
+        '''
+
+        column = values[:, i]
+
+        if column.dtype.kind in 'biufc':
+            return list(map(str, column.tolist()))
+        elif column.dtype.kind in 'mM':
+            return [str(x) for x in self._table.iloc[:, i]]
+
+        # lines of multiline cells are indented as the rest of the table
+        return [str(x).replace('\n', '\n' + indent) for x in column]
+
+    def _generate_colnames_html(self, col_names, style='', classes=None):
+
+        if classes is None:
+            classes = self._classes
 
         colnames_html = f'<thead>\n  <tr style="{style}">\n'
 
-        for elem,td_class in zip(col_names, self._classes):
+        for elem,td_class in zip(col_names, classes):
           if 'num' in td_class:
             just = '"text-align:right;"'
           else:
@@ -932,20 +2128,12 @@ class Table(_Node):
         return colnames_html
 
 
-    def _generate_row_html(self, row, row_style, cell_styles):
-
-        row_html = f'  <tr style="{row_style}">\n'
-
-        for elem,cell_style,td_class in zip(row, cell_styles, self._classes):
-
-          row_html += f'   <td {td_class}style="{cell_style}">{elem}</td>\n'
-
-        row_html += '  </tr>'
-
-        return row_html
-
     @property
     def _classes(self):
+        '''
+        html classes of the columns, num for the numerical ones. Renders
+        keep them in the render cache of the table.
+        '''
 
         classes = []
         for i in range(self._table.shape[1]):
@@ -0,0 +1,335 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Micro-benchmarks for the rendering hot paths. Run as a script:
+
+    python test/benchmarks.py
+"""
+
+import os
+import sys
+import timeit
+
+cdir = os.path.dirname(__file__)
+examples_folder = os.path.join(cdir, 'examples')
+sys.path.insert(0, os.path.join(cdir, '..'))
+
+from PyReports import _internal
+
+
+def _time(func, *args, number=20):
+
+    return min(timeit.repeat(lambda: func(*args), number=number, repeat=3))/number
+
+
+def bench_html_tokenizer():
+    '''
+    tokenizing the html of plots and maps, BeautifulSoup against the
+    streaming tokenizer
+    '''
+
+    for name in ['plotlyplot1.html', 'acmap1.html']:
+        with open(os.path.join(examples_folder, name), 'r') as fp:
+            html = fp.read()
+
+        bs4_time = _time(_internal._html_tokenizer_bs4, html)
+        fast_time = _time(_internal.html_tokenizer, html)
+
+        print(f'html_tokenizer {name}: bs4 {1000*bs4_time:.2f} ms, '
+              f'streaming {1000*fast_time:.2f} ms')
+
+
+def bench_table(nrows=100000, ncols=20):
+    '''
+    rendering a table with half numeric and half string columns
+    '''
+
+    import numpy as np
+    import pandas as pd
+    import PyReports as pr
+
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame({**{f'num{i}':rng.standard_normal(nrows) for i in range(ncols//2)},
+                          **{f'str{i}':rng.choice(['foo', 'bar', 'baz'], nrows)
+                             for i in range(ncols - ncols//2)}})
+
+    with pr.Report('Benchmark') as report:
+        pr.Tbl(table)
+
+    table_time = _time(report.to_html, None, True, number=1)
+
+    print(f'table {nrows}x{ncols}: {table_time:.2f} s')
+
+
+def bench_table_classes(nrows=100000, ncols=20):
+    '''
+    classifying the columns of a wide table, element by element against
+    using the dtypes
+    '''
+
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(0)
+    table = pd.DataFrame({**{f'num{i}':rng.standard_normal(nrows) for i in range(ncols//2)},
+                          **{f'str{i}':rng.choice(['1', '2.5', '-3'], nrows)
+                             for i in range(ncols - ncols//2)}})
+    columns = [table.iloc[:, i] for i in range(ncols)]
+
+    items_time = _time(lambda: [_internal._is_num_items(x) for x in columns], number=1)
+    dtype_time = _time(lambda: [_internal._class(x) for x in columns], number=1)
+
+    print(f'table classes {nrows}x{ncols}: by element {1000*items_time:.1f} ms, '
+          f'by dtype {1000*dtype_time:.1f} ms')
+
+
+def bench_figure():
+    '''
+    serializing a matplotlib figure: saving, decoding and encoding it again
+    with PIL against saving it once
+    '''
+
+    import io
+    import numpy as np
+    import matplotlib.pyplot as plt
+    import PIL
+
+    fig, ax = plt.subplots()
+    ax.plot(np.random.default_rng(0).standard_normal(10000))
+
+    def twice():
+        buffer = io.BytesIO()
+        fig.savefig(buffer)
+        return _internal.image_to_byte_array(PIL.Image.open(buffer))
+
+    twice_time = _time(twice, number=5)
+    once_time = _time(_internal.figure_to_bytes, fig, number=5)
+
+    print(f'figure: encoded twice {1000*twice_time:.1f} ms, '
+          f'once {1000*once_time:.1f} ms')
+    plt.close(fig)
+
+def bench_format_text(nlines=100000):
+    '''
+    formatting a long log with quoted lines, first time and once cached
+    '''
+
+    text = '\n'.join(f'    {i}: read "sample_{i}.fasta" in {i%7} ms'
+                      for i in range(nlines))
+
+    def first():
+        _internal.format_text.cache_clear()
+        return _internal.format_text(text, 2)
+
+    first_time = _time(first, number=1)
+    cached_time = _time(_internal.format_text, text, 2, number=1)
+
+    print(f'format_text {nlines} lines: {1000*first_time:.1f} ms, '
+          f'cached {1e6*cached_time:.1f} us')
+
+def bench_import_time(budget=0.3):
+    '''
+    time of python -c "import PyReports", which should stay below budget
+    seconds since heavy dependencies are only imported when used
+    '''
+
+    import subprocess
+
+    def run():
+        subprocess.run([sys.executable, '-c', 'import PyReports'], check=True,
+                       cwd=os.path.join(cdir, '..'))
+
+    import_time = _time(run, number=5)
+
+    print(f'import PyReports: {1000*import_time:.0f} ms '
+          f'({"within" if import_time < budget else "over"} the budget of '
+          f'{1000*budget:.0f} ms)')
+
+def bench_small_reports(nreports=1000):
+    '''
+    creating and rendering many small reports with code, parsing the config
+    and reading the code style for each against loading them once
+    '''
+
+    import PyReports as pr
+    from PyReports import config
+
+    def reports(clear):
+        for i in range(nreports):
+            if clear:
+                config.clear_cache()
+            with pr.Report(f'Report {i}') as report:
+                with pr.Section('Code'):
+                    pr.Cde('print("Hello world")')
+            report.to_html(None, return_html=True)
+
+    uncached_time = _time(reports, True, number=1)
+    cached_time = _time(reports, False, number=1)
+
+    print(f'{nreports} small reports: reading config each time {uncached_time:.2f} s, '
+          f'cached {cached_time:.2f} s')
+
+def bench_restructuring(nsections=4000):
+    '''
+    removing every other subsection of a large report through the report and
+    numbering the remaining sections
+    '''
+
+    import PyReports as pr
+
+    def restructure():
+        with pr.Report('Benchmark') as report:
+            subsections = []
+            for i in range(nsections):
+                with pr.Section(f'Section {i}'):
+                    with pr.Section('Subsection') as subsection:
+                        pr.Txt('Lorem Ipsum')
+                    subsections.append(subsection)
+
+        start = timeit.default_timer()
+        for subsection in subsections[::2]:
+            report.remove(subsection)
+        pr._render.RenderContext(report).section_no_str
+
+        return timeit.default_timer() - start
+
+    restructure_time = min(restructure() for _ in range(3))
+
+    print(f'restructuring {nsections} sections: {1000*restructure_time:.1f} ms')
+
+def bench_traversal(nsections=1000):
+    '''
+    walking, summarizing and rendering a report with many sections, and the
+    peak memory of walking it as a list against as an iterator
+    '''
+
+    import tracemalloc
+    import PyReports as pr
+
+    with pr.Report('Benchmark') as report:
+        for i in range(nsections):
+            with pr.Section(f'Section {i}'):
+                with pr.Section('Subsection'):
+                    pr.Txt('Lorem Ipsum')
+                    pr.Txt('Lorem Ipsum')
+
+    summary_time = _time(report.summary, number=1)
+    render_time = _time(report.to_html, None, True, number=1)
+
+    peaks = []
+    for walk in [report._descendants, lambda: sum(1 for _ in report.iter_descendants())]:
+        tracemalloc.start()
+        walk()
+        peaks.append(tracemalloc.get_traced_memory()[1])
+        tracemalloc.stop()
+
+    print(f'traversal of {nsections} sections: summary {1000*summary_time:.1f} ms, '
+          f'render {1000*render_time:.1f} ms, peak memory as a list '
+          f'{peaks[0]/1024:.1f} KiB, as an iterator {peaks[1]/1024:.1f} KiB')
+
+_NODE_MEMORY = '''
+import sys, timeit, tracemalloc
+sys.path.insert(0, sys.argv[1])
+import PyReports as pr
+
+with pr.Report('Benchmark'):
+    with pr.Section('Section') as section:
+        pass
+
+for make in [lambda: pr.Txt('Lorem Ipsum', parent=section),
+             lambda: pr.Lnk('https://github.com', 'github', parent=section)]:
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    nodes = [make() for _ in range(int(sys.argv[2]))]
+    size = (tracemalloc.get_traced_memory()[0] - before)/len(nodes)
+    tracemalloc.stop()
+
+    write_time = min(timeit.repeat(lambda: setattr(nodes[-1], '_end', ''),
+                                   number=100000, repeat=3))/100000
+    print(type(nodes[-1]).__name__, size, write_time)
+'''
+
+def bench_node_memory(nnodes=10000, baseline='ece4d3a~'):
+    '''
+    memory per Text and Link node and the time of writing an attribute,
+    against the same for the PyReports of the baseline revision (the one
+    before nodes kept their attributes in __slots__). Each is measured in a
+    separate process.
+    '''
+
+    import io
+    import subprocess
+    import tarfile
+    import tempfile
+
+    def measure(tree):
+        output = subprocess.run([sys.executable, '-c', _NODE_MEMORY, tree, str(nnodes)],
+                                capture_output=True, text=True, check=True).stdout
+
+        return {name:(float(size), float(write_time)) for name, size, write_time
+                in (line.split() for line in output.splitlines())}
+
+    with tempfile.TemporaryDirectory() as directory:
+        archive = subprocess.run(['git', 'archive', baseline, 'PyReports'],
+                                 cwd=os.path.join(cdir, '..'), capture_output=True,
+                                 check=True).stdout
+        tarfile.open(fileobj=io.BytesIO(archive)).extractall(directory)
+
+        results = [measure(os.path.join(cdir, '..')), measure(directory)]
+
+    for name in results[0]:
+        (size, write_time), (baseline_size, baseline_write_time) = [x[name] for x in results]
+
+        print(f'{name} node: {size:.0f} bytes ({baseline_size:.0f} at {baseline}), '
+              f'attribute write {1e9*write_time:.0f} ns ({1e9*baseline_write_time:.0f} '
+              f'at {baseline})')
+
+def bench_batch(nnodes=20000, depth=200):
+    '''
+    building a deep report node by node against in a batch, and a wide one
+    for which a batch makes little difference (see Report.batch)
+    '''
+
+    import PyReports as pr
+
+    def wide(report):
+        for i in range(nnodes//10):
+            with pr.Section(f'Section {i}'):
+                for _ in range(9):
+                    pr.Txt('Lorem Ipsum')
+
+    def deep(report):
+        parent = report
+        for i in range(depth):
+            parent = pr.Section(f'Section {i}', parent=parent)
+        for _ in range(nnodes//10):
+            pr.Txt('Lorem Ipsum', parent=parent)
+
+    def build(body, batch):
+        with pr.Report('Benchmark') as report:
+            if batch:
+                with report.batch():
+                    body(report)
+            else:
+                body(report)
+
+    for body in [wide, deep]:
+        times = [_time(build, body, batch, number=1) for batch in [False, True]]
+
+        print(f'building a {body.__name__} report: node by node {1000*times[0]:.0f} ms, '
+              f'in a batch {1000*times[1]:.0f} ms')
+
+
+if __name__ == '__main__':
+
+    bench_html_tokenizer()
+    bench_table()
+    bench_table_classes()
+    bench_figure()
+    bench_format_text()
+    bench_import_time()
+    bench_small_reports()
+    bench_restructuring()
+    bench_traversal()
+    bench_node_memory()
+    bench_batch()
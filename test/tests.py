@@ -8,8 +8,13 @@ Created on Sat May  7 19:22:59 2022
 
 import unittest
 import PyReports as pr
+import io
+import re
+import asyncio
+import tempfile
 import os
 import sys
+import subprocess
 cdir = os.path.dirname(__file__)
 examples_folder = os.path.join(cdir, 'examples')
 sys.path.insert(1,  examples_folder)
@@ -118,6 +123,33 @@ class TestParenting(unittest.TestCase):
         self.assertTrue(text._parent != subsection1)
 
 
+    def test_type_counts(self):
+
+        with pr.Report('Test1') as report1:
+            with pr.Section('Section1') as section1:
+                with pr.Tab(['Tab1']):
+                    pr.Txt('Lorem Ipsum')
+                pr.Qte('Lorem Ipsum')
+
+        report2 = pr.Report('Test2')
+
+        self.assertTrue(report1._has_tab and not report2._has_tab)
+        self.assertTrue(report1._count(pr.Txt) == 2)
+        self.assertTrue(report1._items('tab') == [x for x in report1._descendants()
+                                                  if isinstance(x, pr.Tab)])
+
+        section1._parent = report2
+
+        self.assertTrue(report2._has_tab and not report1._has_tab)
+        self.assertTrue(report1._count(pr.Txt) == 0 and report2._count(pr.Txt) == 2)
+        self.assertTrue(report2._count(pr.Grid) == 1)
+
+        report2.remove(section1)
+
+        self.assertTrue(report2._count(pr.Section) == 0)
+        self.assertTrue(not report2._has_grid)
+
+
     def test_parent_child_relation_checker(self):
 
         with pr.Report('Test1') as report1:
@@ -133,5 +165,827 @@ class TestParenting(unittest.TestCase):
         self.assertTrue(section1._parent != report1)
 
 
+    def test_tree_restructuring(self):
+
+        import weakref
+
+        with pr.Report('Test1') as report:
+            for i in range(5):
+                with pr.Section(f'Section{i}'):
+                    with pr.Section('Subsection') as subsection:
+                        pr.Txt('Lorem Ipsum')
+
+        sections = report.sections
+
+        # subsections are removed through the report too
+        report.remove(subsection)
+        self.assertTrue(len(sections[-1].sections) == 0 and subsection._parent is None)
+
+        report.remove(sections[1])
+        self.assertTrue([x._section_no_str for x in report.sections] == ['1', '2', '3', '4'])
+        self.assertTrue(sections[2].sections[0]._section_no_str == '2.1')
+
+        # removed branches are freed without waiting for garbage collection
+        removed = weakref.ref(sections[2])
+        text = sections[2].sections[0]._children[0]
+        report.remove(sections[2])
+        del sections
+
+        self.assertTrue(removed() is None and text._parent is None)
+        self.assertTrue(len(report.sections) == 3)
+
+
+    def test_weak_parents(self):
+
+        import gc
+
+        def make_section(report=None):
+            return pr.Section('Section', parent=pr.Report('Test') if report is None else report)
+
+        # parents are only weakly referenced, a report which nothing else
+        # keeps is freed along with the section's link to it
+        section = make_section()
+        gc.collect()
+        self.assertTrue(section._parent is None)
+
+        report = pr.Report('Test')
+        section = make_section(report)
+        gc.collect()
+        self.assertTrue(section._parent is report and section in report.sections)
+
+    def test_traversal(self):
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1') as section1:
+                with pr.Tab(['Tab1', 'Tab2']):
+                    pr.Txt('Lorem Ipsum')
+                    text = pr.Txt('Lorem Ipsum')
+            with pr.Section('Section2'):
+                pr.Txt('Lorem Ipsum')
+
+        self.assertTrue(list(report.iter_descendants()) == report._descendants())
+        self.assertTrue(list(report.iter_descendants(pr.Section)) == [section1, report.sections[1]])
+        self.assertTrue(list(text.iter_ancestors())[-2:] == [section1, report])
+        self.assertTrue(list(text.iter_ancestors(until=section1, item_class=pr.Section)) == [section1])
+
+        # deeper than the recursion limit allows for recursive traversals
+        recursion_limit = sys.getrecursionlimit()
+        sys.setrecursionlimit(400)
+
+        try:
+            report = pr.Report('Test2')
+            parent = report
+            for i in range(500):
+                parent = pr.Section(f'Section{i}', parent=parent)
+            pr.Txt('Lorem Ipsum', parent=parent)
+
+            self.assertTrue(len(list(report.iter_descendants())) == 502)
+            self.assertTrue('Lorem Ipsum' in report.to_html(None, return_html=True))
+        finally:
+            sys.setrecursionlimit(recursion_limit)
+
+    def test_compact_nodes(self):
+
+        import pickle
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1') as section1:
+                text = pr.Txt('Lorem Ipsum')
+                pr.Lnk('https://github.com', 'github')
+            with pr.Section('Section2') as section2:
+                pass
+
+        self.assertFalse(hasattr(text, '__dict__'))
+        self.assertTrue(pr.Txt._fields() == ['_text', '_font_size', '_alignment',
+                                             '_end', '_style', '_formatted'])
+        with self.assertRaises(AttributeError):
+            text._txt = 'Dolor sit amet'
+
+        # nodes without children share their bookkeeping until they get one
+        self.assertTrue(text._type_counts is pr.Txt._own_type_counts())
+        self.assertTrue(text._children is section2._children)
+        self.assertTrue(text._render_cache is section2._render_cache)
+        self.assertTrue(section2._type_counts is pr.Section._own_type_counts())
+
+        # setting the parent still moves the node
+        text._parent = section2
+        self.assertTrue(text in section2._children and text not in section1._children)
+        self.assertTrue(report._count(pr.Txt) == 1)
+        self.assertTrue(section2._count(pr.Txt) == 1 and pr.Txt not in pr.Section._own_type_counts())
+        self.assertTrue(section2._children is not text._children)
+
+        report.to_html(None, return_html=True, cache=True)
+        copy = pickle.loads(pickle.dumps(report))
+        self.assertTrue(copy.to_html(None, return_html=True) ==
+                        report.to_html(None, return_html=True))
+        self.assertTrue(copy.sections[1]._children[0]._parent is copy.sections[1])
+
+    def test_batch(self):
+
+        def build(report):
+            for i in range(3):
+                with pr.Section(f'Section{i}'):
+                    pr.Txt('Lorem Ipsum')
+                    with pr.Tab(['Tab1', 'Tab2']):
+                        pr.Txt('Tab 1')
+                        pr.Txt('Tab 2')
+
+        with pr.Report('Test1') as report1:
+            build(report1)
+
+        with pr.Report('Test1') as report2:
+            with report2.batch():
+                build(report2)
+
+        self.assertTrue(report2._count(pr.Txt) == 9 and report2._has_tab)
+        self.assertTrue([x._type_counts for x in report1.iter_descendants()] ==
+                        [x._type_counts for x in report2.iter_descendants()])
+        self.assertTrue(report1.to_html(None, return_html=True) ==
+                        report2.to_html(None, return_html=True))
+
+        # the parents are checked when the batch ends
+        text = report2.sections[0]._children[0]
+        with self.assertRaises(ValueError):
+            with report2.batch():
+                pr.Txt('Lorem Ipsum', parent=text)
+
+        with self.assertRaises(ValueError):
+            pr.Txt('Lorem Ipsum', parent=text)
+
+        # the report is not up to date inside a batch
+        with report2.batch():
+            for render in [lambda: report2.to_html(None, return_html=True),
+                           lambda: report2.write_html(io.StringIO()),
+                           lambda: asyncio.run(report2.to_html_async(None, return_html=True)),
+                           report2.summary, report2.__str__,
+                           report2.sections[0].summary]:
+                with self.assertRaises(ValueError):
+                    render()
+
+        # other reports are built and rendered as usual meanwhile, also from
+        # other threads
+        import threading
+
+        html1 = report1.to_html(None, return_html=True)
+
+        with report2.batch():
+            pr.Txt('Lorem Ipsum', parent=report2.sections[0])
+            text = pr.Txt('Lorem Ipsum', parent=report1.sections[0])
+
+            self.assertTrue(report1._count(pr.Txt) == 10)
+            with self.assertRaises(ValueError):
+                pr.Txt('Lorem Ipsum', parent=text)
+
+            report1.remove(text)
+            htmls = []
+            thread = threading.Thread(target=lambda: htmls.append(report1.to_html(None, return_html=True)))
+            thread.start()
+            thread.join()
+            self.assertTrue(htmls == [html1])
+
+            # a branch moved out of the report is no longer a part of the batch
+            section = report2.sections[2]
+            section._parent = report1
+            pr.Txt('Lorem Ipsum', parent=section)
+            self.assertTrue(report1._count(pr.Txt) == 13)
+
+        self.assertTrue(report2._count(pr.Txt) == 8)
+
+class TestRendering(unittest.TestCase):
+
+
+    def _report(self):
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1'):
+                pr.Txt('Lorem Ipsum')
+                with pr.Tab(['Tab1','Tab2']):
+                    pr.Txt('Tab 1')
+                    pr.Txt('Tab 2')
+                pr.Cde('print("Lorem Ipsum")')
+                with pr.Section('Subsection1', has_tex=True):
+                    pr.Txt('$x^2$')
+
+        return report
+
+
+    def test_streaming_sinks(self):
+
+        report = self._report()
+        html = report.to_html(None, return_html=True)
+
+        text_sink = io.StringIO()
+        report.to_html(text_sink)
+
+        binary_sink = io.BytesIO()
+        report.to_html(binary_sink)
+
+        self.assertTrue(text_sink.getvalue() == html)
+        self.assertTrue(binary_sink.getvalue().decode('utf-8') == html)
+        self.assertTrue(html.startswith('<!-- Report generated by PyReports'))
+        self.assertTrue(html.endswith('</html>'))
+
+
+    def test_render_context(self):
+
+        report = self._report()
+
+        with report:
+            with pr.Section('Section2') as section2:
+                with pr.Section('Subsection1') as subsection21:
+                    with pr.Tab(['Tab1']) as tab:
+                        pr.Txt('Tab 1')
+                    with pr.Fold() as fold:
+                        pr.Txt('Fold 1')
+
+        ctx = pr._render.RenderContext(report)
+
+        self.assertTrue(ctx.depth[report] == 0)
+        self.assertTrue(ctx.depth[subsection21] == subsection21._depth == 2)
+        self.assertTrue(ctx.section_no_str[section2] == section2._section_no_str == '2')
+        self.assertTrue(ctx.section_no_str[subsection21] == subsection21._section_no_str == '2.1')
+        self.assertTrue(ctx.tab_item_ids[tab] == [2])
+        self.assertTrue(ctx.tab_name[tab] == 'TAB-2-0')
+        self.assertTrue([ctx.fold_name[x] for x in report._folds] == ['FOLD-1-0', 'FOLD-2-0'])
+        self.assertTrue(ctx.fold_name[fold] == 'FOLD-2-0')
+
+        summary = pr._io.to_ascii(report, detailed=False, formatting='none',
+                                  link_to_sections=True, ctx=ctx)
+        self.assertTrue('<a href="#S2.1">Subsection1</a>' in summary)
+        self.assertTrue(summary == report.summary(link_to_sections=True))
+
+
+    def test_render_cache(self):
+
+        report = self._report()
+        text = report.sections[0]._children[0]
+
+        html1 = report.to_html(None, return_html=True, cache=True)
+        self.assertTrue('html' in text._render_cache and not text._dirty)
+
+        html2 = report.to_html(None, return_html=True, cache=True)
+        self.assertTrue(html1 == html2)
+
+        text._text = 'Dolor sit amet'
+        self.assertTrue(text._dirty and report._dirty and 'html' not in text._render_cache)
+
+        # moving section1 after a new section with a tab changes the ids of
+        # the tabs in section1 even though section1 itself is not modified
+        section1 = report.sections[0]
+        with report:
+            with pr.Section('Section2'):
+                with pr.Tab(['Tab3']):
+                    pr.Txt('Tab 3')
+
+        section1._parent = None
+        section1._parent = report
+
+        html3 = report.to_html(None, return_html=True, cache=True)
+        report.clear_render_cache()
+        html4 = report.to_html(None, return_html=True)
+
+        self.assertTrue(html3 == html4)
+        self.assertTrue('Dolor sit amet' in html3)
+        self.assertTrue('html' not in text._render_cache)
+
+
+    def test_render_cache_reparenting(self):
+
+        # an image is indented differently in a grid and in a section at the
+        # same depth, so its cached html can not be reused after moving it
+        with pr.Report('Test') as report:
+            with pr.Section('Section1'):
+                with pr.Grid(1,1) as grid:
+                    image = pr.Img(os.path.join(examples_folder, 'image1.jpeg'))
+            with pr.Section('Section2'):
+                subsection = pr.Section('Subsection1')
+
+        report.to_html(None, return_html=True, cache=True)
+        self.assertTrue('\n' + ' '*8 + '<img' in image._render_cache['html'][1])
+
+        grid.remove(image)
+        self.assertTrue(image._dirty and 'html' not in image._render_cache)
+
+        image._parent = subsection
+
+        html = report.to_html(None, return_html=True, cache=True)
+        self.assertTrue('\n' + ' '*12 + '<img' in image._render_cache['html'][1])
+
+        report.clear_render_cache()
+        self.assertTrue(html == report.to_html(None, return_html=True))
+
+
+    def test_parallel_rendering(self):
+
+        report = self._report()
+
+        with report:
+            with pr.Section('Images'):
+                with pr.Grid(2,1):
+                    pr.Img(os.path.join(examples_folder, 'image1.jpeg'))
+                    pr.Img(os.path.join(examples_folder, 'image2.jpeg'))
+                pr.Img(os.path.join(examples_folder, 'image5.jpeg'), title='Image5')
+
+        html = report.to_html(None, return_html=True)
+
+        self.assertTrue(report.to_html(None, return_html=True, workers=2) == html)
+
+
+    def test_async_rendering(self):
+
+        report = self._report()
+
+        with report:
+            with pr.Section('Assets'):
+                pr.Img(os.path.join(examples_folder, 'image1.jpeg'))
+                pr.Img(os.path.join(examples_folder, 'image1.jpeg'), embed=False)
+                pr.Plt(os.path.join(examples_folder, 'plotlyplot1.html'))
+                pr.Amp(os.path.join(examples_folder, 'acmap1.html'))
+                pr.Img(os.path.join(examples_folder, 'image5.jpeg'))
+
+        html = report.to_html(None, return_html=True)
+
+        for concurrency in [1, 4]:
+            async_html = asyncio.run(report.to_html_async(None, return_html=True,
+                                                          concurrency=concurrency))
+            self.assertTrue(async_html == html)
+
+        with self.assertRaises(ValueError):
+            asyncio.run(report.to_html_async(None, concurrency=0, return_html=True))
+
+
+    def test_asset_dedup(self):
+
+        report = self._report()
+        image1 = os.path.join(examples_folder, 'image1.jpeg')
+
+        with report:
+            with pr.Section('Images'):
+                with pr.Tab(['a', 'b']):
+                    pr.Img(image1)
+                    pr.Img(image1, title='again')
+                pr.Img(os.path.join(examples_folder, 'image2.jpeg'))
+                pr.Img(image1, embed=False)
+
+        html = report.to_html(None, return_html=True)
+        dedup_html = report.to_html(None, return_html=True, dedup_assets=True)
+
+        self.assertTrue(len(dedup_html) < len(html))
+        self.assertTrue(dedup_html.count('data:image/jpeg;base64') == 2)
+        self.assertTrue(dedup_html.count('data-asset="ASSET-0"') == 1)
+        self.assertTrue(dedup_html.count('data-asset-ref="ASSET-0"') == 1)
+        self.assertTrue('data-asset' not in html)
+
+        self.assertTrue(report.to_html(None, return_html=True, dedup_assets=True,
+                                       workers=2) == dedup_html)
+
+
+    def test_sidecar_assets(self):
+
+        report = self._report()
+        image1 = os.path.join(examples_folder, 'image1.jpeg')
+
+        with report:
+            with pr.Section('Assets'):
+                pr.Img(image1)
+                pr.Img(image1, embed=False)
+                pr.Plt(os.path.join(examples_folder, 'plotlyplot1.html'))
+
+        with tempfile.TemporaryDirectory() as directory:
+            output_path = os.path.join(directory, 'report.html')
+            html = report.to_html(output_path, return_html=True, assets='sidecar')
+
+            self.assertTrue('base64' not in html)
+            self.assertTrue('plotly.js' not in html)
+
+            urls = re.findall(r'src="(report_assets/[^"]*)"', html)
+
+            # both images are the same file
+            self.assertTrue(len([x for x in urls if x.endswith('.jpeg')]) == 2)
+            self.assertTrue(len(set(x for x in urls if x.endswith('.jpeg'))) == 1)
+            self.assertTrue(all(os.path.isfile(os.path.join(directory, x)) for x in urls))
+
+            # or streamed into a file
+            with open(os.path.join(directory, 'streamed.html'), 'w') as file:
+                report.write_html(file, assets='sidecar')
+
+            with open(os.path.join(directory, 'streamed.html'), 'r') as file:
+                self.assertTrue('src="streamed_assets/' in file.read())
+
+        with self.assertRaises(ValueError):
+            report.to_html(None, return_html=True, assets='sidecar')
+
+        with self.assertRaises(ValueError):
+            report.write_html(io.StringIO(), assets='sidecar')
+
+        # a stream with a name which is not a path
+        with self.assertRaises(ValueError):
+            report.write_html(sys.__stdout__, assets='sidecar')
+
+        self.assertFalse(os.path.exists('<stdout>_assets'))
+
+
+    def test_plotlyjs_once(self):
+
+        report = self._report()
+
+        with report:
+            with pr.Section('Plots'):
+                with pr.Tab(['a', 'b', 'c']):
+                    for _ in range(3):
+                        pr.Plt(os.path.join(examples_folder, 'plotlyplot1.html'))
+
+        # each plot is tokenized once per render
+        from PyReports import _internal
+        html_tokenizer = _internal.html_tokenizer
+        ntokenized = []
+        _internal.html_tokenizer = lambda html: ntokenized.append(1) or html_tokenizer(html)
+
+        try:
+            html = report.to_html(None, return_html=True)
+        finally:
+            _internal.html_tokenizer = html_tokenizer
+
+        self.assertTrue(len(ntokenized) == 3)
+        self.assertTrue(html.count('plotly.js v') == 1)
+        self.assertTrue(html.index('plotly.js v') < html.index('<body'))
+        self.assertTrue(html[html.index('<body'):].count('Plotly.newPlot(') == 3)
+
+    def test_figure_encoded_once(self):
+
+        import plotly.io
+        import plotly.graph_objects as go
+
+        report = self._report()
+
+        with report:
+            with pr.Section('Plots'):
+                # the plots in the file use an older major version of plotly.js
+                # than the figure, so the figure keeps its own
+                pr.Plt(os.path.join(examples_folder, 'plotlyplot1.html'))
+                pr.Plt(go.Figure(go.Scatter(y=[1, 2, 3])))
+
+        to_html = plotly.io.to_html
+        nencoded = []
+        plotly.io.to_html = lambda *args, **kwargs: nencoded.append(1) or to_html(*args, **kwargs)
+
+        try:
+            html = report.to_html(None, return_html=True)
+        finally:
+            plotly.io.to_html = to_html
+
+        self.assertTrue(len(nencoded) == 1)
+        self.assertTrue(html.count('plotly.js v') == 2)
+        self.assertTrue('window.Plotly = window.PyReportsPlotly;' in html)
+
+
+    def test_dependencies(self):
+
+        report = self._report()
+        user_scripts = report._CONFIG['SCRIPTS']['USER SCRIPTS']
+
+        with report:
+            with pr.Section('Map'):
+                pr.Amp(os.path.join(examples_folder, 'acmap1.html'))
+
+        html = report.to_html(None, return_html=True)
+
+        # rendering does not change the config and is repeatable
+        self.assertTrue(report._CONFIG['SCRIPTS']['USER SCRIPTS'] == user_scripts)
+        self.assertTrue(report.to_html(None, return_html=True) == html)
+
+        # scripts which are not needed for the first paint are after the body
+        head_html = html[:html.index('<!-- START REPORT -->')]
+        self.assertTrue('function open_tab(' not in head_html)
+        self.assertTrue(html.rindex('function open_tab(') > html.index('Map</h2>'))
+        self.assertTrue('<script src="data:application/javascript' in head_html)
+
+
+    def test_html_tokenizer(self):
+
+        from PyReports import _internal
+
+        for name in ['plotlyplot1.html', 'acmap1.html', 'tab_in_tab.html']:
+            with open(os.path.join(examples_folder, name), 'r') as fp:
+                html = fp.read()
+
+            self.assertTrue(_internal.html_tokenizer(html) ==
+                            _internal._html_tokenizer_bs4(html))
+
+        for html in ['<p>\n  \n</p>', '<p>&nbsp;</p>', '<p><b> x </b></p>', '<img src="a.png">']:
+            self.assertTrue(_internal.html_is_blank(html) ==
+                            _internal._html_is_blank_bs4(html))
+
+        with pr.Report('Test1') as report:
+            with pr.Grid(2):
+                pr.Txt('Lorem Ipsum')
+                pr.Txt('')
+
+        # only the empty text gets the background of the grid
+        html = report.to_html(None, return_html=True)
+        self.assertTrue(html.count('background-color: inherit;') == 1)
+
+
+
+    def test_table_rendering(self):
+
+        import pandas as pd
+
+        table = pd.DataFrame({'int':[1, 2, 3], 'float':[0.5, 1.0, 1.5],
+                              'str':['a', 'b\nc', '1']})
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1'):
+                pr.Tbl(table, background_colors=[None, 'red', None],
+                       cell_colors=[[None]*3, [None, 'blue', None], [None]*3])
+
+        html = report.to_html(None, return_html=True)
+
+        self.assertTrue(html.count('<tr style=') == 4)
+        self.assertTrue('<tr style="background-color:red">' in html)
+        self.assertTrue('<td class="num"style="background-color:blue">1.0</td>' in html)
+        self.assertTrue('<td class="num"style="">1</td>' in html)
+        # multiline cells are indented with the rest of the table
+        self.assertTrue(re.search('<td style="">b\n {8,}c</td>', html) is not None)
+
+
+    def test_virtual_table(self):
+
+        import json
+        import pandas as pd
+
+        table = pd.DataFrame({'int':range(1000), 'str':['<b>a</b>']*1000})
+
+        with self.assertRaises(ValueError):
+            pr.Tbl(table, mode='lazy', parent=pr.Report('Test1'))
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1'):
+                pr.Tbl(table, mode='virtual', cell_colors=[[None, 'red']]*1000)
+
+        html = report.to_html(None, return_html=True)
+        data_json = re.search('<script type="application/json" class="table-data">(.*?)</script>',
+                              html).group(1)
+        data = json.loads(data_json)
+
+        # rows are only created by the script
+        self.assertTrue('>999</td>' not in html)
+        self.assertTrue('<b>' not in data_json and data['columns'][1][0] == '<b>a</b>')
+        self.assertTrue(data['nrows'] == 1000 and data['num'] == [True, False])
+        self.assertTrue(data['cellStyles'][0] is None and data['cellStyles'][1][0] == 'background-color:red')
+        self.assertTrue('class VirtualTable' in html and '.virtual-table {' in html)
+
+
+    def test_table_classes(self):
+
+        import numpy as np
+        import pandas as pd
+
+        table = pd.DataFrame({'float':[0.5, np.nan], 'num_str':['1', ' 2.5 '],
+                              'str':['1', 'a'], 'mixed':[1, '1e3'], 'none':pd.Series([1, None], dtype=object),
+                              'nullable':pd.array([1, None], dtype='Int64'),
+                              'date':pd.to_datetime(['2022-01-01', '2022-01-02'])})
+
+        with pr.Report('Test1') as report:
+            table_node = pr.Tbl(table)
+
+        self.assertTrue(table_node._classes == ['class="num"', 'class="num"', '',
+                                                'class="num"', '', '', ''])
+
+        report.to_html(None, return_html=True, cache=True)
+        self.assertTrue(table_node._render_cache['classes'] == table_node._classes)
+
+        table_node._table = table.iloc[:, ::-1]
+        self.assertTrue('classes' not in table_node._render_cache)
+
+
+    def test_image_transcode(self):
+
+        import base64
+        import PIL
+
+        image_path = os.path.join(examples_folder, 'image1.jpeg')
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1'):
+                pr.Img(image_path)
+                pr.Img(image_path, width=100, height=100, transcode='webp', srcset=[2])
+                pr.Img(image_path, scale=0.1, transcode='png', dpr=2)
+
+        with self.assertRaises(ValueError):
+            pr.Img(image_path, transcode='gif', parent=report)
+
+        html = report.to_html(None, return_html=True)
+        srcs = re.findall('data:(image/[a-z]+);base64,([^"]*)"', html)
+        sizes = [PIL.Image.open(io.BytesIO(base64.b64decode(data))).size for _, data in srcs]
+
+        # the mime type matches the image, images are shrunk to their displayed size
+        self.assertTrue([mime_type for mime_type, _ in srcs] ==
+                        ['image/jpeg', 'image/webp', 'image/webp', 'image/png'])
+        self.assertTrue(sizes == [(500, 889), (100, 100), (200, 200), (100, 178)])
+        self.assertTrue(re.search(r'srcset="data:image/webp;base64,[^" ]* 2x"', html) is not None)
+
+
+    def test_figure_formats(self):
+
+        import base64
+        import numpy as np
+        import PIL
+        import matplotlib.pyplot as plt
+
+        fig, ax = plt.subplots()
+        ax.plot(np.sin(np.linspace(0, 10, 1000)))
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1'):
+                pr.Img(fig)
+                pr.Img(fig, fig_format='svg', simplify=0.5)
+                pr.Img(fig, fig_format='jpg', dpi=50)
+
+        html = report.to_html(None, return_html=True)
+        srcs = re.findall('data:(image/[a-z+]+);base64,([^"]*)"', html)
+
+        self.assertTrue([mime_type for mime_type, _ in srcs] ==
+                        ['image/png', 'image/svg+xml', 'image/jpeg'])
+        self.assertTrue(base64.b64decode(srcs[1][1]).startswith(b'<?xml'))
+
+        # the png has the same pixels as the figure saved through PIL
+        buffer = io.BytesIO()
+        fig.savefig(buffer)
+        png = np.asarray(PIL.Image.open(io.BytesIO(base64.b64decode(srcs[0][1]))))
+        self.assertTrue(np.array_equal(png, np.asarray(PIL.Image.open(buffer))))
+
+        with self.assertRaises(ValueError):
+            pr.Img(os.path.join(examples_folder, 'image1.jpeg'), dpi=100, parent=report)
+        plt.close(fig)
+
+
+    def test_deferred_content(self):
+
+        report = self._report()
+        html = report.to_html(None, return_html=True)
+
+        with report:
+            with pr.Section('Section2'):
+                with pr.Tab(['Tab1', 'Tab2', 'Tab3'], defer=True):
+                    pr.Txt('Tab 1')
+                    pr.Txt('Tab 2')
+                    pr.Txt('Tab 3')
+                with pr.Fold(defer=True):
+                    pr.Txt('Folded')
+
+        deferred_html = report.to_html(None, return_html=True)
+
+        # only the tabs which are not open by default and the fold are deferred
+        self.assertTrue('<template data-deferred>' not in html)
+        self.assertTrue('function materialize_deferred(' not in html)
+        self.assertTrue(deferred_html.count('<template data-deferred>') == 3)
+        self.assertTrue(re.search(r'<template data-deferred>\s*<p[^>]*>\s*Tab 1', deferred_html) is None)
+        self.assertTrue(re.search(r'<template data-deferred>\s*<p[^>]*>\s*Folded', deferred_html) is not None)
+        self.assertTrue('function materialize_deferred(' in deferred_html)
+
+
+    def test_code_highlighting(self):
+
+        code_text = 'def f(x):\n    return x<1 # comment'
+
+        with pr.Report('Test1') as report:
+            with pr.Section('Section1'):
+                pr.Cde(code_text, highlight='pygments')
+
+        html = report.to_html(None, return_html=True)
+
+        self.assertTrue('<span class="kwd">def</span>' in html)
+        self.assertTrue('<span class="pun">&lt;</span>' in html)
+        self.assertTrue('<span class="com"># comment</span>' in html)
+        # code styles are kept but code-prettify is not needed
+        self.assertTrue('.kwd' in html and 'run_prettify' not in html)
+
+        with report:
+            with pr.Section('Section2'):
+                pr.Cde(code_text)
+
+        self.assertTrue('run_prettify' in report.to_html(None, return_html=True))
+
+        with self.assertRaises(ValueError):
+            pr.Cde(code_text, highlight='highlight.js', parent=report)
+
+    def test_text_formatting(self):
+
+        from PyReports import _internal
+
+        text = '''
+            first line
+                indented "quoted
+            text"
+
+            - item 1
+            - item 2
+        '''
+
+        self.assertTrue(_internal.format_text(text, 0) ==
+                        '        first line\n'
+                        '        &nbsp;&nbsp;&nbsp;&nbsp;indented "quoted            text"\n'
+                        '        <br><br>\n'
+                        '        - item 1<br>\n'
+                        '        - item 2')
+        self.assertTrue(_internal.format_text('a\n\nb', 1, formatted=True) ==
+                        '            a<br>\n            \n            b<br>')
+        self.assertTrue(_internal.format_text('def f():\n    return 1\n', 0,
+                                              leading_space=' ', is_code=True) ==
+                        'def f():<br>\n    return 1<br>')
+
+        # formatted once however many times the same paragraph is rendered
+        _internal.format_text.cache_clear()
+        with pr.Report('Test1') as report:
+            for _ in range(10):
+                pr.Txt(text)
+        report.to_html(None, return_html=True)
+        self.assertTrue(_internal.format_text.cache_info().misses == 1)
+
+    def test_lazy_imports(self):
+
+        # heavy dependencies are only imported by the nodes which need them
+        script = ('import sys, PyReports as pr\n'
+                  'heavy = ["matplotlib", "PIL", "plotly", "bs4", "numpy", "pandas", "pygments"]\n'
+                  'print([x for x in heavy if x in sys.modules])\n'
+                  'with pr.Report("Test1") as report:\n'
+                  '    pr.Txt("Lorem Ipsum")\n'
+                  'report.to_html(None, return_html=True)\n'
+                  'print([x for x in heavy if x in sys.modules])\n'
+                  'pr.Img(None, parent=report)\n'
+                  'print([x for x in heavy if x in sys.modules])\n')
+
+        output = subprocess.run([sys.executable, '-c', script], capture_output=True,
+                                text=True, check=True, cwd=os.path.join(cdir, '..')).stdout
+
+        self.assertTrue(output.split('\n')[:3] == ['[]', '[]', "['PIL']"])
+
+        self.assertTrue(isinstance(pr.config.config, dict))
+
+        # loaded once, changes to it are kept
+        self.assertTrue(pr.config.config is pr.config.config)
+
+    def test_config_cache(self):
+
+        from PyReports import config
+
+        report1 = pr.Report('Test1')
+        report2 = pr.Report('Test2')
+
+        # the reports share the parsed config, items set in one stay in it
+        self.assertTrue(report1._CONFIG['STYLES'].maps[1] is report2._CONFIG['STYLES'].maps[1])
+        report1._CONFIG['STYLES']['USER STYLES'] = '    p {color: red;}'
+        self.assertTrue(report2._CONFIG['STYLES']['USER STYLES'] !=
+                        report1._CONFIG['STYLES']['USER STYLES'])
+        self.assertTrue(config.load_config()['STYLES']['USER STYLES'] ==
+                        report2._CONFIG['STYLES']['USER STYLES'])
+
+        # the views are saved as plain dicts
+        with tempfile.TemporaryDirectory() as temp_dir:
+            report1.to_json(os.path.join(temp_dir, 'report.json'))
+            report3 = pr.from_json(os.path.join(temp_dir, 'report.json'))
+        self.assertTrue(report3._CONFIG['STYLES']['USER STYLES'] == '    p {color: red;}')
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, 'style.css')
+
+            with open(path, 'w') as fp:
+                fp.write('p {color: red;}\n')
+            self.assertTrue(config.load_css(path) == '    p {color: red;}\n')
+
+            # read again once modified
+            with open(path, 'w') as fp:
+                fp.write('p {color: blue;}\n')
+            os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10**9))
+            self.assertTrue(config.load_css(path) == '    p {color: blue;}\n')
+
+    def test_old_json(self):
+
+        # saved before the arguments added since then (defer etc.) existed
+        report = pr.from_json(os.path.join(examples_folder, 'old_report.json'))
+        section = report.sections[0]
+        tab, fold, code_fold = section._children[1:4]
+
+        self.assertTrue(not tab._defer and not fold._defer and not code_fold._defer)
+
+        code = code_fold._children[0]
+        self.assertTrue(code._highlight == 'prettify' and code._language == 'python')
+
+        image = section._children[4]
+        self.assertTrue(image._transcode is None and image._quality == 85 and
+                        image._dpr == 1 and image._srcset is None)
+        self.assertTrue(image._fig_format == 'png' and image._dpi is None and
+                        image._simplify is None)
+        self.assertTrue('Folded' in report.to_html(None, return_html=True))
+
+        # tables are only saved in memory, as the dict of an older version
+        import pandas as pd
+        table = pr.Tbl(pd.DataFrame({'a':[1, 2], 'b':['x', 'y']}), parent=section)
+        jdict = pr._io._to_dict(table)
+        del jdict['_mode']
+
+        self.assertTrue(pr.from_json(_jdict=jdict, _parent=section)._mode == 'static')
+
 if __name__ == '__main__':
     unittest.main()